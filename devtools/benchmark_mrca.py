@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Time MRCA and taxtable intersection queries on a reference package
+
+Times Refpkg.most_recent_common_ancestor (an in-memory index) and the
+equivalent query of the taxonomy database loaded by Refpkg.load_db, for
+random sets of tax_ids from seq_info. The database query joins tax_ids
+to their ancestors in the table built by Taxdb.create_closure (as in a
+database cached by load_db). With --view, it is also timed with
+``parents`` left as the view of nested set intervals of the hierarchy
+table, which takes time linear in the number of taxa per tax_id.
+Finally, the query ``taxit refpkg_intersection`` used to make is timed
+on the closure table for the refpkg's own taxonomy; it is not run on
+the view, where it takes quadratic time. For example:
+
+    python devtools/benchmark_mrca.py my.refpkg --view
+"""
+
+import argparse
+import csv
+import random
+import sys
+import time
+
+from taxtastic.refpkg import Refpkg
+
+SQL_MRCA = """
+    SELECT parent
+      FROM _mrca_temp
+           CROSS JOIN parents USING (child)
+           JOIN taxa
+             ON parent = taxa.tax_id
+           JOIN ranks USING (rank)
+     GROUP BY parent
+    HAVING COUNT(*) = ?
+     ORDER BY rank_order DESC
+     LIMIT 1
+"""
+
+INTERSECTION = """
+    SELECT tax_id,
+           COALESCE(itaxa.rank, "")
+      FROM taxa
+           LEFT JOIN (SELECT child AS tax_id,
+                             rank_order,
+                             rank
+                        FROM parents
+                             JOIN taxa
+                               ON tax_id = parent
+                             JOIN ranks USING (rank)
+                       WHERE rank IN (%s)) itaxa USING (tax_id)
+     ORDER BY tax_id,
+              rank_order DESC
+"""
+
+
+def sql_mrca(db, ts):
+    # what Refpkg.most_recent_common_ancestor used to do
+    db.execute('DROP TABLE IF EXISTS _mrca_temp')
+    db.execute('CREATE TEMPORARY TABLE _mrca_temp '
+               '(child TEXT PRIMARY KEY NOT NULL)')
+    db.executemany('INSERT INTO _mrca_temp VALUES (?)', ((t,) for t in ts))
+    (res,), = db.execute(SQL_MRCA, (len(ts),)).fetchall()
+    return res
+
+
+def time_mrca(func, queries):
+    start = time.time()
+    results = [func(q) for q in queries]
+    return time.time() - start, results
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('refpkg', help='reference package directory')
+    parser.add_argument('-n', '--number', type=int, default=100,
+                        help='MRCA queries of each size [%(default)s]')
+    parser.add_argument('-s', '--sizes', default='2,20,500',
+                        help='comma-separated numbers of tax_ids per '
+                        'MRCA query [%(default)s]')
+    parser.add_argument('-r', '--ranks', default='genus,family,order',
+                        help='ranks for the intersection query '
+                        '[%(default)s]')
+    parser.add_argument('--view', action='store_true',
+                        help='also time database queries using the view')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(arguments)
+
+    rp = Refpkg(args.refpkg, create=False)
+    start = time.time()
+    rp.load_db()
+    ntaxa, = rp.db.execute('SELECT COUNT(*) FROM taxa').fetchone()
+    print '{:<25} {:8.2f} s ({} taxa)'.format(
+        'load_db', time.time() - start, ntaxa)
+
+    with rp.open_resource('seq_info', 'rU') as f:
+        tax_ids = sorted(set(row['tax_id'] for row in csv.DictReader(f)))
+    random.seed(args.seed)
+    sizes = [int(i) for i in args.sizes.split(',')]
+    queries = {size: [tuple(random.sample(tax_ids, size))
+                      for _ in range(args.number)]
+               for size in sizes}
+
+    start = time.time()
+    rp.mrca_index()
+    print '{:<25} {:8.2f} s'.format('mrca_index', time.time() - start)
+
+    results = {}
+    for size in sizes:
+        elapsed, results[size] = time_mrca(
+            lambda q: rp.most_recent_common_ancestor(*q), queries[size])
+        print '{:<25} {:8.2f} ms'.format(
+            'mrca of {}'.format(size), elapsed * 1000 / args.number)
+
+    if args.view:
+        for size in sizes:
+            elapsed, view_results = time_mrca(
+                lambda q: sql_mrca(rp.db, q), queries[size])
+            print '{:<25} {:8.2f} ms'.format(
+                'view sql mrca of {}'.format(size),
+                elapsed * 1000 / args.number)
+            assert view_results == results[size]
+
+    start = time.time()
+    rp.db.create_closure()
+    rows, = rp.db.execute('SELECT COUNT(*) FROM parents').fetchone()
+    print '{:<25} {:8.2f} s ({} rows)'.format(
+        'create_closure', time.time() - start, rows)
+
+    for size in sizes:
+        elapsed, sql_results = time_mrca(
+            lambda q: sql_mrca(rp.db, q), queries[size])
+        print '{:<25} {:8.2f} ms'.format(
+            'sql mrca of {}'.format(size), elapsed * 1000 / args.number)
+        assert sql_results == results[size]
+
+    ranks = args.ranks.split(',')
+    start = time.time()
+    rows = rp.db.execute(
+        INTERSECTION % ', '.join('?' * len(ranks)), ranks).fetchall()
+    print '{:<25} {:8.2f} s ({} rows)'.format(
+        'sql intersection', time.time() - start, len(rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Time construction of a Taxonomy object and the first lineage lookup
+
+Compares the current constructor with reflecting the entire database
+schema (what Taxonomy.__init__ used to do). For example:
+
+    python devtools/benchmark_startup.py sqlite:///testfiles/small_taxonomy.db
+"""
+
+import argparse
+import sys
+import timeit
+
+import sqlalchemy
+from sqlalchemy import MetaData
+
+from taxtastic.taxonomy import Taxonomy
+from taxtastic.utils import sqlite_default
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('url', type=sqlite_default(),
+                        help='database string URI or filename')
+    parser.add_argument('--schema')
+    parser.add_argument('-t', '--tax-id', default='1280',
+                        help='tax_id to look up [%(default)s]')
+    parser.add_argument('-n', '--number', type=int, default=20,
+                        help='repetitions per measurement [%(default)s]')
+    args = parser.parse_args(arguments)
+
+    engine = sqlalchemy.create_engine(args.url)
+
+    def reflect():
+        meta = MetaData(schema=args.schema, bind=engine)
+        meta.reflect()
+
+    def construct():
+        Taxonomy(engine, schema=args.schema)
+
+    def construct_and_lookup():
+        Taxonomy(engine, schema=args.schema).lineage(args.tax_id)
+
+    for label, func in [('reflect entire schema', reflect),
+                        ('Taxonomy()', construct),
+                        ('Taxonomy() + lineage', construct_and_lookup)]:
+        elapsed = timeit.timeit(func, number=args.number) / args.number
+        print '{:<25} {:8.2f} ms'.format(label, elapsed * 1000)
+
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure memory used by a TaxNode tree loaded from a taxtable
+
+Compares TaxNode with nodes laid out as before (attributes in an
+instance dictionary, unshared rank strings, and sets of children and
+sequence_ids allocated for every node). Each tree is built in a new
+process and the increase in peak resident memory is reported. For
+example:
+
+    taxit taxtable ncbi_taxonomy.db -o taxtable.csv
+    python devtools/benchmark_taxnode_memory.py taxtable.csv
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+from taxtastic.taxtable import TaxNode
+
+
+class DictTaxNode(TaxNode):
+    """
+    TaxNode with the memory layout of the original implementation
+    """
+
+    def __init__(self, rank, tax_id, **kwargs):
+        super(DictTaxNode, self).__init__(rank, tax_id, **kwargs)
+        self.__dict__.update(
+            ranks=self.ranks, rank=rank, name=self.name, tax_id=self.tax_id,
+            parent=self.parent, index=self.index,
+            children=set(self.children), sequence_ids=set(self.sequence_ids))
+
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(cls, taxtable, queue):
+    before = maxrss()
+    start = time.time()
+    with open(taxtable) as fp:
+        root = cls.from_taxtable(fp)
+    elapsed = time.time() - start
+    queue.put((len(root.index), maxrss() - before, elapsed))
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('taxtable', help='taxtable in csv format')
+    args = parser.parse_args(arguments)
+
+    results = []
+    for label, cls in [('dict nodes', DictTaxNode),
+                       ('TaxNode', TaxNode)]:
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(
+            target=measure, args=(cls, args.taxtable, queue))
+        proc.start()
+        nodes, kb, elapsed = queue.get()
+        proc.join()
+        results.append(kb)
+        print '{:<25} {:8.1f} MB {:8.2f} s ({} nodes, {:.0f} bytes/node)'.format(
+            label, kb / 1024.0, elapsed, nodes, kb * 1024.0 / nodes)
+
+    print '{:<25} {:8.1f}x'.format('reduction', results[0] / float(results[1]))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Time removing invalid nodes from a full taxtable (taxit taxtable --valid)
+
+Compares building the full taxtable and then masking each rank column
+with the tax_ids of invalid nodes of that rank (what --valid used to
+do) with removing invalid nodes from the integer coded lineages while
+the taxtable is built (build_taxtable with valid=True). With
+--cache-dir, the same comparison is made for reading a cached
+taxtable. For example:
+
+    python devtools/benchmark_valid.py sqlite:///ncbi_taxonomy.db
+"""
+
+import argparse
+import sys
+import time
+
+import pandas
+import sqlalchemy
+
+from taxtastic.subcommands.taxtable import full_taxtable, cached_taxtable
+from taxtastic.taxonomy import Taxonomy
+from taxtastic.utils import sqlite_default
+
+
+def groupby_invalid(taxtable):
+    invalid = taxtable[~taxtable['is_valid']]
+    for r, g in invalid.groupby(by='rank'):
+        taxtable.loc[taxtable[r].isin(g.index), r] = None
+    return taxtable[taxtable['is_valid']]
+
+
+def compare(label, load):
+    start = time.time()
+    first = groupby_invalid(load(False))
+    print '{:<25} {:8.2f} s'.format(label + ', groupby rank', time.time() - start)
+    start = time.time()
+    second = load(True)
+    print '{:<25} {:8.2f} s ({} nodes)'.format(
+        label + ', valid', time.time() - start, len(second))
+    # ranks with only invalid nodes are empty columns in the first
+    first = first.reindex(columns=second.columns)
+    assert first.fillna('').equals(second.fillna(''))
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('url', type=sqlite_default(),
+                        help='database string URI or filename')
+    parser.add_argument('--schema')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='also compare reading a taxtable cached in DIR')
+    args = parser.parse_args(arguments)
+
+    engine = sqlalchemy.create_engine(args.url)
+    ranks = pandas.read_sql_table('ranks', engine, schema=args.schema)
+    ranks = ranks.sort_values(by='height', ascending=False)['rank'].tolist()
+
+    compare('build', lambda valid: full_taxtable(
+        engine, args.schema, ranks, valid=valid))
+
+    if args.cache_dir:
+        tax = Taxonomy(engine, schema=args.schema)
+        cached_taxtable(tax, ranks, args.cache_dir)
+        compare('cached', lambda valid: cached_taxtable(
+            tax, ranks, args.cache_dir, valid=valid))
+
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -26,8 +26,9 @@ import zipfile
 
 import sqlalchemy
 from sqlalchemy import (Column, Integer, String, Boolean,
-                        ForeignKey, Index, MetaData)
+                        ForeignKey, Index, MetaData, Table)
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -171,6 +172,7 @@ def define_schema(Base):
         sources = relationship('Source', back_populates='names')
 
     Index('ix_names_tax_id_is_primary', Name.tax_id, Name.is_primary)
+    Index('ix_names_tax_name', Name.tax_name)
 
     class Merge(Base):
         __tablename__ = 'merged'
@@ -194,6 +196,20 @@ def define_schema(Base):
         names = relationship('Name')
 
 
+def define_taxonomy(metadata, ranks):
+    """
+    Define a wide ``taxonomy`` table of lineages with one row per
+    tax_id and one indexed column per rank. ``ranks`` should be
+    ordered from the root down.
+    """
+    columns = [Column('tax_id', String, primary_key=True, nullable=False),
+               Column('parent_id', String),
+               Column('rank', String),
+               Column('tax_name', String)]
+    columns.extend(Column(rank, String, index=True) for rank in ranks)
+    return Table('taxonomy', metadata, *columns)
+
+
 def db_connect(engine, schema=None, clobber=False):
     """
     Create a connection object to a database. Attempt to establish a
@@ -322,6 +338,34 @@ def db_load(engine, archive, schema=None):
         index=False)
 
 
+def db_load_taxonomy(engine, metadata, taxtable, ranks):
+    """
+    Materialize ``taxtable`` (a lineage DataFrame indexed by tax_id
+    such as the one built by ``taxit taxtable``) as table "taxonomy".
+    Any existing taxonomy table is replaced. Rank column indexes are
+    created after the rows are inserted.
+    """
+    table = define_taxonomy(metadata, ranks)
+    table.drop(bind=engine, checkfirst=True)
+    engine.execute(CreateTable(table))
+
+    columns = [c.name for c in table.columns if c.name != 'tax_id']
+    taxtable = taxtable.reindex(columns=columns)
+    taxtable.index.name = 'tax_id'
+
+    logging.info('Inserting taxonomy')
+    taxtable.to_sql(
+        'taxonomy', engine,
+        schema=metadata.schema,
+        if_exists='append')
+
+    logging.info('Indexing taxonomy rank columns')
+    for index in table.indexes:
+        index.create(bind=engine)
+
+    return table
+
+
 def adjust_node_ranks(df, ranks):
     '''
     replace no_ranks with below_ of parent rank
@@ -34,6 +34,7 @@ import functools
 import hashlib
 import json
 import shutil
+import sqlite3
 import subprocess
 import tempfile
 import zipfile
@@ -45,6 +46,9 @@ from taxtastic import utils, taxdb
 
 FORMAT_VERSION = '1.1'
 
+# version of the layout of databases cached by Refpkg.load_db
+DB_CACHE_VERSION = 3
+
 
 class DerivedFileNotUpdatedWarning(UserWarning):
     pass
@@ -184,6 +188,7 @@ class Refpkg(object):
         self._set_defaults()
 
         self.db = None
+        self._mrca_index = None
 
     def _install_zipfile_handlers(self):
         self._archive = zipfile.ZipFile(self.path)
@@ -718,14 +723,57 @@ class Refpkg(object):
 
         return False
 
-    def load_db(self):
+    def load_db(self, cache_dir=None):
         """Load the taxonomy into a sqlite3 database.
 
         This will set ``self.db`` to a sqlite3 database which contains all of
         the taxonomic information in the reference package.
-        """
 
-        db = taxdb.Taxdb()
+        If *cache_dir* is given, the database is saved there in a file
+        named for the md5s of the taxonomy and seq_info, and later calls
+        open that file (memory mapped) instead of building the database
+        again. Since it is built only once, ``parents`` in a cached
+        database is the table made by ``Taxdb.create_closure``, indexed
+        for looking up the ancestors of tax_ids. A cached database is
+        shared, so it is opened with ``PRAGMA query_only`` and attempts
+        to modify it raise ``sqlite3.OperationalError``.
+        """
+        if cache_dir is None:
+            db = taxdb.Taxdb()
+            self._build_db(db)
+            self.db = db
+            return
+
+        fname = os.path.join(cache_dir, 'taxdb-{}-{}-{}.db'.format(
+            DB_CACHE_VERSION, self.resource_md5('taxonomy'),
+            self.resource_md5('seq_info')))
+        if not os.path.exists(fname):
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # build in a temporary file so a complete database appears
+            # under its final name at once
+            with tempfile.NamedTemporaryFile(
+                    dir=cache_dir, delete=False) as tmp:
+                pass
+            try:
+                db = taxdb.Taxdb(sqlite3.connect(tmp.name))
+                db.execute('PRAGMA journal_mode = OFF')
+                db.execute('PRAGMA synchronous = OFF')
+                self._build_db(db)
+                db.create_closure()
+                db.close()
+                os.chmod(tmp.name, 0o644)
+                os.rename(tmp.name, fname)
+            except Exception:
+                os.unlink(tmp.name)
+                raise
+
+        db = taxdb.Taxdb(sqlite3.connect(fname))
+        db.execute('PRAGMA mmap_size = {}'.format(os.path.getsize(fname)))
+        db.execute('PRAGMA query_only = ON')
+        self.db = db
+
+    def _build_db(self, db):
         db.create_tables()
         reader = csv.DictReader(self.open_resource('taxonomy', 'rU'))
         db.insert_from_taxtable(lambda: reader._fieldnames, reader)
@@ -736,81 +784,33 @@ class Refpkg(object):
                          ((row['seqname'], row['tax_id']) for row in reader))
 
         db.commit()
-        self.db = db
+
+    def mrca_index(self):
+        """Return a ``taxdb.MrcaIndex`` of the taxonomy.
+
+        The index is built the first time it is needed and again after
+        the taxonomy is updated.
+        """
+        md5 = self.resource_md5('taxonomy')
+        if self._mrca_index is None or self._mrca_index[0] != md5:
+            with self.open_resource('taxonomy', 'rU') as f:
+                self._mrca_index = md5, taxdb.MrcaIndex.from_taxtable(f)
+        return self._mrca_index[1]
 
     def most_recent_common_ancestor(self, *ts):
         """Find the MRCA of some tax_ids.
 
         Returns the MRCA of the specified tax_ids, or raises ``NoAncestor`` if
         no ancestor of the specified tax_ids could be found.
-        """
-        if len(ts) > 200:
-            res = self._large_mrca(ts)
-        else:
-            res = self._small_mrca(ts)
 
-        if res:
-            (res,), = res
-        else:
+        Queries are answered from an in-memory index of the taxonomy (see
+        ``mrca_index``), so ``load_db`` is not required.
+        """
+        res = self.mrca_index().mrca(ts)
+        if res is None:
             raise NoAncestor()
         return res
 
-    def _large_mrca(self, ts):
-        """Find the MRCA using a temporary table."""
-        cursor = self.db.cursor()
-
-        cursor.execute("""
-            DROP TABLE IF EXISTS _mrca_temp
-        """)
-
-        cursor.execute("""
-            CREATE TEMPORARY TABLE _mrca_temp(
-                child TEXT PRIMARY KEY REFERENCES taxa (tax_id) NOT NULL
-            )
-        """)
-
-        cursor.executemany("""
-            INSERT INTO _mrca_temp
-            VALUES (?)
-        """, ((tid,) for tid in ts))
-        cursor.execute("""
-            SELECT parent
-            FROM   _mrca_temp
-                   JOIN parents USING (child)
-                   JOIN taxa
-                     ON parent = taxa.tax_id
-                   JOIN ranks USING (rank)
-            GROUP  BY parent
-            HAVING COUNT(*) = ?
-            ORDER  BY rank_order DESC
-            LIMIT  1
-        """, (len(ts),))
-
-        return cursor.fetchall()
-
-    def _small_mrca(self, ts):
-        """Find a MRCA using query parameters.
-
-        This only supports a limited number of tax_ids; ``_large_mrca`` will
-        support an arbitrary number.
-        """
-        cursor = self.db.cursor()
-        qmarks = ', '.join('?' * len(ts))
-        cursor.execute("""
-            SELECT parent
-            FROM   parents
-                   JOIN taxa
-                     ON parent = taxa.tax_id
-                   JOIN ranks USING (rank)
-            WHERE  child IN (%s)
-            GROUP  BY parent
-            HAVING COUNT(*) = ?
-            ORDER  BY rank_order DESC
-            LIMIT  1
-        """ % qmarks, ts + (len(ts),))
-
-        return cursor.fetchall()
-
     def file_abspath(self, resource):
         """Deprecated alias for *resource_path*."""
         warnings.warn(
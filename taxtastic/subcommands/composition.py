@@ -21,6 +21,7 @@ import sys
 import argparse
 
 from taxtastic import refpkg
+from taxtastic.taxtable import read_table
 
 log = logging.getLogger(__name__)
 
@@ -70,8 +71,8 @@ def action(args):
             sys.exit('Error: --taxonomy and --seq-info are '
                      'required if refpkg is not provided.')
 
-    with open(taxonomy, 'rU') as f:
-        taxdict = {r['tax_id']: r for r in csv.DictReader(f)}
+    taxdict = read_table(taxonomy).fillna('').set_index('tax_id', drop=False)
+    taxdict = taxdict.to_dict('index')
 
     unclassified = '<unclassified at this rank>'
     counts = Counter()
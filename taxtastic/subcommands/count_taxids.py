@@ -7,13 +7,16 @@ Returns taxonomy with columns ['tax_id', 'tax_name', 'rank', 'count']
 import pandas
 import sys
 
+from taxtastic.taxtable import read_table
+
 
 def build_parser(p):
     # inputs
     p.add_argument(
         'taxonomy',
-        help="""Taxonomy metadata, minimum columns with
-        ordered column taxonomy - [tax_id, root,...,{last_rank}]""")
+        help="""Taxonomy metadata in csv, Parquet or Arrow format,
+        minimum columns with ordered column taxonomy -
+        [tax_id, root,...,{last_rank}]""")
     p.add_argument(
         '-i', '--seq-info',
         help=('csv of actual sequence representatives. '
@@ -25,7 +28,7 @@ def build_parser(p):
 
 
 def action(args):
-    lineage = pandas.read_csv(args.taxonomy, dtype=str)
+    lineage = read_table(args.taxonomy)
 
     if args.seq_info:
         seqinfo = pandas.read_csv(args.seq_info, usecols=['tax_id'], dtype=str)
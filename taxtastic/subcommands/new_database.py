@@ -20,13 +20,21 @@ already exists, it will fail and leave it untouched unless you specify
 ``-x`` or ``--clobber``.  The NCBI taxonomy will be downloaded into
 the same directory as ``database_file`` will be created in unless you
 specify ``-p`` or ``--download-dir``.
+
+With ``--taxonomy-table`` a wide table of lineages named ``taxonomy``
+(one row per tax_id and one indexed column per rank) is materialized
+after loading.  ``taxit add_nodes`` keeps this table up to date and
+lineage lookups use it in place of walking up to the root.
 """
 import argparse
 import logging
+import pandas
 import sqlalchemy
 import sys
 import taxtastic
 
+from taxtastic.subcommands.taxtable import build_taxtable
+
 log = logging.getLogger(__name__)
 
 
@@ -40,6 +48,12 @@ def build_parser(parser):
         help=('If database exists keep current data '
               'and append new data. [False]'))
 
+    parser.add_argument(
+        '--taxonomy-table',
+        action='store_true',
+        help=('Materialize a "taxonomy" table of lineages with '
+              'one indexed column per rank [False]'))
+
     download_parser = parser.add_argument_group(title='download options')
     download_parser.add_argument(
         '-z', '--taxdump-file',
@@ -79,9 +93,35 @@ def action(args):
     base = taxtastic.ncbi.db_connect(
         engine, schema=args.schema, clobber=args.clobber)
     taxtastic.ncbi.db_load(engine, zfile, schema=args.schema)
+    if args.taxonomy_table:
+        load_taxonomy_table(engine, base.metadata)
     print_sql(args.out, engine.name, base.metadata)
 
 
+def load_taxonomy_table(engine, metadata):
+    """
+    Build lineages from the nodes and names tables and materialize them
+    as table "taxonomy".
+    """
+    schema = metadata.schema
+    ranks_df = pandas.read_sql_table('ranks', engine, schema=schema)
+    ranks = ranks_df.sort_values(by='height', ascending=False)['rank'].tolist()
+
+    log.info('building taxonomy lineages')
+    nodes = pandas.read_sql_table(
+        'nodes', engine, schema=schema, index_col='tax_id',
+        columns=['tax_id', 'parent_id', 'rank'])
+    names = pandas.read_sql_table(
+        'names', engine,
+        schema=schema,
+        columns=['tax_id', 'tax_name', 'is_primary'])
+    names = names[names['is_primary']].set_index('tax_id')
+    nodes = nodes.join(names['tax_name'])
+    taxtable = build_taxtable(nodes, ranks)
+
+    return taxtastic.ncbi.db_load_taxonomy(engine, metadata, taxtable, ranks)
+
+
 def print_sql(out, engine_name, metadata):
     def dump(sql, *multiparams, **params):
         out.write(str(sql.compile(dialect=dump.dialect)).strip() + ';\n')
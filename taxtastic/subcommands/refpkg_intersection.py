@@ -1,16 +1,14 @@
 """Find the intersection of a taxtable and a refpkg's taxonomy."""
 
-import sqlite3
 import logging
 import sys
 import csv
 import argparse
-import tempfile
 import itertools
-import operator
+
+import numpy
 
 from taxtastic.refpkg import Refpkg
-from taxtastic.taxdb import Taxdb
 
 log = logging.getLogger(__name__)
 
@@ -28,61 +26,113 @@ def build_parser(parser):
                         help='output file in csv format (default is stdout)')
 
 
-def test_output(infile, outfile, ranks):
+def test_output(taxids_in, taxids_out):
     """
-    Ensure that all input taxids (provided in a taxtable) are represented in the
-    output.
+    Ensure that all input taxids (of the listed ranks in the input
+    taxtable) are represented in the output.
     """
-
-    with open(infile, 'rU') as i, open(outfile, 'rU') as o:
-        taxids_in = set(d['tax_id']
-                        for d in csv.DictReader(i) if d['rank'] in ranks)
-        taxids_out = set(d['tax_id'] for d in csv.DictReader(o))
-
-        assert len(taxids_in - taxids_out) == 0, taxids_in - taxids_out
+    assert len(taxids_in - taxids_out) == 0, taxids_in - taxids_out
 
 
-def filter_ranks(results):
+def lineage_ranks(parents, orders):
+    """
+    Find the ancestors of each node (including the node itself) which
+    have one of the listed ranks.
+
+    ``parents`` holds the position of the parent of each node, or the
+    node's own position for a root, and ``orders`` the rank_order of
+    each node or -1 if its rank is not listed. All nodes are walked up
+    their lineages together, one level at a time. Returns arrays
+    ``nodes`` and ``ancestors`` of the positions of each such pair.
+    """
+    parents = numpy.asarray(parents, dtype=numpy.int64)
+    orders = numpy.asarray(orders, dtype=numpy.int64)
+    nodes = numpy.arange(len(parents))
+    ancestors = nodes.copy()
+    found_nodes, found_ancestors = [nodes[:0]], [nodes[:0]]
+    for _ in xrange(len(parents) + 1):
+        if not len(nodes):
+            break
+        ranked = orders[ancestors] >= 0
+        found_nodes.append(nodes[ranked])
+        found_ancestors.append(ancestors[ranked])
+        up = parents[ancestors]
+        below_root = up != ancestors
+        nodes, ancestors = nodes[below_root], up[below_root]
+    else:
+        raise ValueError('cycle in taxtable')
+    return numpy.concatenate(found_nodes), numpy.concatenate(found_ancestors)
+
+
+def intersection(tax_ids, parents, orders, all_ranks=False):
     """
-    Find just the first rank for all the results for a given tax_id.
+    Generate pairs ``(node, rank_order)`` of the positions of nodes
+    and the rank_order of each of their ancestors with a listed rank,
+    sorted by tax_id and then from the lowest rank. Nodes without such
+    an ancestor are paired with -1. Without ``all_ranks`` only the
+    lowest rank of each node is generated.
     """
-    for _, group in itertools.groupby(results, operator.itemgetter(0)):
-        yield next(group)
+    orders = numpy.asarray(orders, dtype=numpy.int64)
+    nodes, ancestors = lineage_ranks(parents, orders)
+    found = numpy.zeros(len(tax_ids), dtype=bool)
+    found[nodes] = True
+    missing = numpy.flatnonzero(~found)
+    nodes = numpy.concatenate([nodes, missing])
+    ranks = numpy.concatenate([orders[ancestors],
+                               numpy.full(len(missing), -1, numpy.int64)])
+
+    sort_keys = numpy.empty(len(tax_ids), dtype=numpy.int64)
+    sort_keys[sorted(xrange(len(tax_ids)), key=tax_ids.__getitem__)] = \
+        numpy.arange(len(tax_ids))
+    order = numpy.lexsort((-ranks, sort_keys[nodes]))
+    nodes, ranks = nodes[order], ranks[order]
+    if not all_ranks:
+        first = numpy.ones(len(nodes), dtype=bool)
+        first[1:] = nodes[1:] != nodes[:-1]
+        nodes, ranks = nodes[first], ranks[first]
+    return itertools.izip(nodes.tolist(), ranks.tolist())
 
 
 def action(args):
     rp = Refpkg(args.refpkg, create=False)
-    rp.load_db()
-    cursor = rp.db.cursor()
     ranks = args.ranks.split(',')
 
-    with tempfile.NamedTemporaryFile() as tmp_db:
-        taxtable_db = Taxdb(sqlite3.connect(tmp_db.name))
-        taxtable_db.create_tables()
-        reader = csv.DictReader(args.infile)
-        taxtable_db.insert_from_taxtable(lambda: reader._fieldnames, reader)
-        cursor.execute('ATTACH DATABASE ? AS tt', (tmp_db.name,))
-
-        writer = csv.writer(args.out)
-        writer.writerow(('tax_id', 'intersection_rank'))
-        cursor.execute("""
-            SELECT tax_id,
-                   COALESCE(itaxa.rank, "")
-              FROM tt.taxa
-                   LEFT JOIN (SELECT child AS tax_id,
-                                     rank_order,
-                                     rank
-                                FROM tt.parents
-                                     JOIN taxa
-                                       ON tax_id = parent
-                                     JOIN ranks USING (rank)
-                               WHERE rank IN (%s)) itaxa USING (tax_id)
-             ORDER BY tax_id,
-                      rank_order DESC
-        """ % ', '.join('?' * len(ranks)), ranks)
-        if not args.all_ranks:
-            cursor = filter_ranks(cursor)
-        writer.writerows(cursor)
-
-    args.out.flush()
-    test_output(args.infile.name, args.out.name, ranks)
+    with rp.open_resource('taxonomy', 'rU') as f:
+        rows = csv.reader(f)
+        header = next(rows)
+        # rank_order -1 (no listed rank) is written as an empty rank
+        rank_names = header[4:] + ['']
+        rank_orders = {rank: i for i, rank in enumerate(header[4:])
+                       if rank in ranks}
+        rank_i = header.index('rank')
+        tax_id_i = header.index('tax_id')
+        refpkg_orders = {row[tax_id_i]: rank_orders[row[rank_i]]
+                         for row in rows if row[rank_i] in rank_orders}
+
+    rows = csv.reader(args.infile)
+    header = next(rows)
+    tax_id_i = header.index('tax_id')
+    parent_i = header.index('parent_id')
+    rank_i = header.index('rank')
+    tax_ids, parent_ids, taxids_in = [], [], set()
+    for row in rows:
+        tax_ids.append(row[tax_id_i])
+        parent_ids.append(row[parent_i])
+        if row[rank_i] in ranks:
+            taxids_in.add(row[tax_id_i])
+
+    # nodes with a missing parent are roots
+    positions = {tax_id: i for i, tax_id in enumerate(tax_ids)}
+    parents = [positions.get(parent_id, i)
+               for i, parent_id in enumerate(parent_ids)]
+    orders = [refpkg_orders.get(tax_id, -1) for tax_id in tax_ids]
+
+    writer = csv.writer(args.out)
+    writer.writerow(('tax_id', 'intersection_rank'))
+    taxids_out = set()
+    for node, order in intersection(tax_ids, parents, orders, args.all_ranks):
+        tax_id = tax_ids[node]
+        taxids_out.add(tax_id)
+        writer.writerow((tax_id, rank_names[order]))
+
+    test_output(taxids_in, taxids_out)
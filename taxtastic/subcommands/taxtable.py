@@ -36,18 +36,35 @@ semicolons is considered a tax_id.
 tax_ids and taxa names can overlap, nor does anything have to be
 unique within either file.  The nodes will only be written once in the
 CSV output no matter how many times a particular taxon is mentioned.
+
+With ``--parquet`` or ``--arrow`` the taxtable is written in a columnar
+format instead, with ranks dictionary encoded and tax_ids stored as
+integers. These formats require pyarrow and are accepted as input by
+``--taxtable``, ``count_taxids`` and ``composition``.
+
+With ``--cache-dir`` the taxtable of the entire taxonomy is saved in
+that directory under a fingerprint of the database (the size and
+modification time of the sqlite database file and its write-ahead log)
+and reused by later runs against the same, unchanged database. This
+requires a sqlite database file.
 """
 import argparse
+import collections
 import csv
+import hashlib
 import logging
+import numpy
 import os
 import pandas
 import re
 import sqlalchemy
 import sys
+import tempfile
 
 from taxtastic.taxonomy import Taxonomy
-from taxtastic.utils import getlines, add_database_args
+from taxtastic.taxtable import read_table, write_table
+from taxtastic.utils import (
+    getlines, add_database_args, pack_strings, unpack_strings)
 
 log = logging.getLogger(__name__)
 
@@ -72,6 +89,12 @@ def build_parser(parser):
         metavar='CSV',
         help='build from a previous built taxtable')
 
+    input_group.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        help=('cache the full taxtable in DIR and reuse it while the '
+              'taxonomy in the database is unchanged (sqlite only)'))
+
     input_group.add_argument(
         '--clade-ids',
         help=('return top-down tax_id clades'))
@@ -110,6 +133,18 @@ def build_parser(parser):
         help=('Output file containing lineages for the specified taxa '
               'in csv format; writes to stdout if unspecified'))
 
+    output_group.add_argument(
+        '--parquet',
+        metavar='FILE',
+        help=('write lineages in Parquet format instead of csv '
+              '(requires pyarrow)'))
+
+    output_group.add_argument(
+        '--arrow',
+        metavar='FILE',
+        help=('write lineages in Arrow IPC file format instead of csv '
+              '(requires pyarrow)'))
+
 
 def action(args):
     engine = sqlalchemy.create_engine(args.url, echo=args.verbosity > 3)
@@ -121,7 +156,6 @@ def action(args):
     ranks_df = ranks_df.sort_values(by='height', ascending=False)
     ranks = ranks_df['rank'].tolist()
 
-    nodes = None
     subset_ids = set()
 
     # check tax_ids subsets first before building taxtable
@@ -156,52 +190,31 @@ def action(args):
             log.error('no tax_ids to subset taxtable, exiting')
             return
 
-    log.info('loading nodes table from database')
-    nodes = pandas.read_sql_table(
-        'nodes', engine, schema=args.schema, index_col='tax_id')
+    # without subsetting, invalid nodes are removed while the lineages of
+    # the full taxtable are integer coded
+    valid = args.valid and not (args.taxtable or subset_ids or args.clade_ids)
 
     if args.taxtable:
         log.info('using existing taxtable ' + args.taxtable)
-        taxtable = pandas.read_csv(args.taxtable, dtype=str)
+        nodes = pandas.read_sql_table(
+            'nodes', engine, schema=args.schema, index_col='tax_id')
+        taxtable = read_table(args.taxtable)
         taxtable = taxtable.set_index('tax_id')
         taxtable = taxtable.join(nodes[['parent_id', 'is_valid']])
+    elif args.cache_dir:
+        taxtable = cached_taxtable(
+            Taxonomy(engine, schema=args.schema), ranks, args.cache_dir,
+            valid=valid)
+    elif subset_ids and not args.clade_ids:
+        # only the tax_ids and their ancestors are needed
+        log.info('building taxtable for {} tax_ids'.format(len(subset_ids)))
+        taxtable = build_taxtable(subset_nodes(tax, subset_ids), ranks)
     else:
-        log.info('building taxtable')
-        names = pandas.read_sql_table(
-            'names', engine,
-            schema=args.schema,
-            columns=['tax_id', 'tax_name', 'is_primary'])
-        names = names[names['is_primary']].set_index('tax_id')
-        len_nodes = len(nodes)
-        nodes = nodes.join(names['tax_name'])
-        assert len_nodes == len(nodes)
-        taxtable = build_taxtable(nodes, ranks)
+        taxtable = full_taxtable(engine, args.schema, ranks, valid=valid)
 
     # subset taxtable clade lineages
     if args.clade_ids:
-        dtypes = taxtable.dtypes
-        clades = []
-        for i in args.clade_ids.split(','):
-            ancestor = taxtable.loc[i]
-
-            # select all rows where rank column == args.from_id
-            clade = taxtable[taxtable[ancestor['rank']] == i]
-
-            # build taxtable up to root from args.from_id
-            while ancestor.name != '1':  # root
-                parent = taxtable.loc[ancestor['parent_id']]
-                clade = pandas.concat(
-                    [pandas.DataFrame(parent).T, clade])
-                ancestor = parent
-            # reset lost index name after concatenating transposed series
-            clades.append(clade)
-        taxtable = pandas.concat(clades)
-        taxtable = taxtable[~taxtable.index.duplicated()]
-
-        # set index.name and dtypes back after concating transposed series
-        taxtable.index.name = 'tax_id'
-        for d, t in dtypes.iteritems():
-            taxtable[d] = taxtable[d].astype(t)
+        taxtable = select_clades(taxtable, args.clade_ids.split(','))
 
     # subset taxtable by set of tax_ids
     if subset_ids:
@@ -216,7 +229,7 @@ def action(args):
         ranks = ranks_df[~ranks_df['no_rank']]['rank'].tolist()
         taxtable = taxtable[taxtable['rank'].isin(ranks)]
 
-    if args.valid:
+    if args.valid and not valid:
         invalid = taxtable[~taxtable['is_valid']]
         # remove all invalids from the rank columns
         for r, g in invalid.groupby(by='rank'):
@@ -224,31 +237,40 @@ def action(args):
         # remove invalid rows
         taxtable = taxtable[taxtable['is_valid']]
 
-    # clean up empty rank columns
-    taxtable = taxtable.dropna(axis=1, how='all')
+    # final column output without empty rank columns
+    columns = ['rank', 'tax_name'] + [
+        r for r in ranks if r in taxtable.columns and taxtable[r].notnull().any()]
 
-    # sort final column output
-    taxtable = taxtable[
-        ['rank', 'tax_name'] + [r for r in ranks if r in taxtable.columns]]
-
-    # sort rows
-    taxtable['rank'] = taxtable['rank'].astype('category', categories=ranks)
-    taxtable = taxtable.sort_values('rank')
+    # rows in order of rank
+    codes = pandas.Categorical(taxtable['rank'], categories=ranks).codes
+    rows = numpy.argsort(codes, kind='mergesort')
 
     # write and close db
-    taxtable.to_csv(args.out)
+    if args.parquet or args.arrow:
+        taxtable = taxtable.iloc[rows][columns]
+        if args.parquet:
+            write_table(taxtable, args.parquet, 'parquet', ranks)
+        else:
+            write_table(taxtable, args.arrow, 'arrow', ranks)
+    else:
+        write_csv(taxtable, columns, rows, args.out)
     engine.dispose()
 
 
-def all_known(tax_ids, tax):
+def all_known(tax_ids, tax, chunksize=400):
     '''
     Check if ALL tax_ids are known.  Return True/False
     '''
+    tax_ids = sorted(tax_ids)
+    known = set()
+    for i in xrange(0, len(tax_ids), chunksize):
+        s = sqlalchemy.select([tax.nodes.c.tax_id],
+                              tax.nodes.c.tax_id.in_(tax_ids[i:i + chunksize]))
+        known.update(t for t, in s.execute())
+
     all_known = True
     for t in tax_ids:
-        try:
-            tax._node(t)
-        except ValueError:
+        if t not in known:
             # Check for merged
             m = tax._get_merged(t)
             if m and m != t:
@@ -263,43 +285,285 @@ def all_known(tax_ids, tax):
         raise ValueError('Some tax_ids are unknown.  Exiting.')
 
 
-def build_taxtable(nodes, ranks):
+def mask_invalid(lineages, is_valid):
+    '''
+    Remove invalid nodes from an integer coded lineage matrix in place.
+    Codes are positions in the boolean array ``is_valid``, or -1 where
+    a lineage has no node at a rank.
+    '''
+    # code -1 is the last element
+    lineages[numpy.append(~is_valid, False)[lineages]] = -1
+
+
+def write_csv(taxtable, columns, rows, out, chunksize=10000):
+    '''
+    Write columns of taxtable in the order of row numbers ``rows`` as
+    csv, copying at most chunksize rows at a time
+    '''
+    # selecting rows of the whole frame can consolidate (copy) all of
+    # its columns so chunks are assembled from single columns instead
+    columns = [(c, taxtable[c].values) for c in columns]
+    for i in xrange(0, max(len(rows), 1), chunksize):
+        chunk = rows[i:i + chunksize]
+        chunk = pandas.DataFrame(
+            collections.OrderedDict((c, v[chunk]) for c, v in columns),
+            index=taxtable.index[chunk])
+        chunk.to_csv(out, header=i == 0)
+
+
+def select_clades(taxtable, clade_ids):
+    '''
+    Return rows of taxtable that are descendants of any of clade_ids,
+    the clade_ids themselves and all of their ancestors
+    '''
+    clade_ids = pandas.Index(set(clade_ids))
+    unknown = clade_ids.difference(taxtable.index)
+    if len(unknown):
+        raise ValueError('unknown clade ids: ' + ', '.join(unknown))
+
+    # a node is in a clade if the clade id is in its column for the
+    # rank of the clade id
+    keep = numpy.zeros(len(taxtable), dtype=bool)
+    for rank, ids in taxtable.loc[clade_ids].groupby('rank'):
+        keep |= taxtable[rank].isin(ids.index).values
+
+    # ancestors of the clade ids one level at a time up to the root
+    parents = taxtable['parent_id']
+    ancestors = clade_ids
+    level = clade_ids
+    while len(level):
+        level = pandas.Index(parents[level].unique()).difference(ancestors)
+        ancestors = ancestors.union(level)
+    keep |= taxtable.index.isin(ancestors)
+
+    return taxtable[keep]
+
+
+def full_taxtable(engine, schema, ranks, valid=False):
+    '''
+    Build the taxtable of every node in the database, or of every valid
+    node if ``valid`` (see build_taxtable)
+    '''
+    log.info('loading nodes table from database')
+    nodes = pandas.read_sql_table(
+        'nodes', engine, schema=schema, index_col='tax_id')
+    log.info('building taxtable')
+    names = pandas.read_sql_table(
+        'names', engine,
+        schema=schema,
+        columns=['tax_id', 'tax_name', 'is_primary'])
+    names = names[names['is_primary']].set_index('tax_id')
+    len_nodes = len(nodes)
+    nodes = nodes.join(names['tax_name'])
+    assert len_nodes == len(nodes)
+    return build_taxtable(nodes, ranks, valid=valid)
+
+
+# bump when the layout of cached taxtables changes
+CACHE_VERSION = 1
+
+
+def database_fingerprint(tax, ranks):
+    '''
+    Return an md5 hex digest identifying the database contents a
+    taxtable is built from, using metadata that is cheap to read rather
+    than the taxonomy itself: ranks and the path, size and modification
+    time of the sqlite database file and of its write-ahead log, if
+    any. Any write to the database changes one of these files.
+
+    Other databases can be updated in place without a change that is
+    cheap to detect, so they raise ValueError.
+    '''
+    url = tax.engine.url
+    if url.drivername != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('cached taxtables require a sqlite database file')
+    fname = os.path.abspath(url.database)
+    values = [CACHE_VERSION, list(ranks), fname]
+    for f in [fname, fname + '-wal']:
+        if os.path.exists(f):
+            stat = os.stat(f)
+            values.extend([stat.st_size, stat.st_mtime])
+    return hashlib.md5(repr(values)).hexdigest()
+
+
+def write_cache(taxtable, ranks, fname):
+    '''
+    Write a taxtable as a numpy .npz archive of columns. tax_ids, ranks
+    and tax_names are stored with pack_strings. parent_ids and
+    lineages are stored as row numbers (-1 where a node has no
+    ancestor at a rank) and ranks as positions in the list of ranks.
+    '''
+    ranks = list(ranks)
+    columns = [r for r in ranks if r in taxtable.columns]
+    tax_ids = taxtable.index
+    lineages = [tax_ids.get_indexer(taxtable[r]) for r in columns]
+    arrays = {
+        'parent_id': tax_ids.get_indexer(taxtable['parent_id']),
+        'rank': pandas.Categorical(taxtable['rank'], categories=ranks).codes,
+        'is_valid': taxtable['is_valid'].values.astype(bool),
+        'lineages': numpy.column_stack(lineages).astype(numpy.int32)}
+    assert (arrays['parent_id'] != -1).all()
+    for name, values in [('tax_id', tax_ids),
+                         ('tax_name', taxtable['tax_name']),
+                         ('ranks', ranks),
+                         ('columns', columns)]:
+        arrays[name], arrays[name + '_missing'] = pack_strings(list(values))
+
+    # write to a temporary file first so readers never see a partial file
+    dirname = os.path.dirname(os.path.abspath(fname))
+    with tempfile.NamedTemporaryFile(dir=dirname, delete=False) as tmp:
+        numpy.savez(tmp, **arrays)
+    os.chmod(tmp.name, 0o644)
+    os.rename(tmp.name, fname)
+
+
+def read_cache(fname, valid=False):
+    '''
+    Read a taxtable written by write_cache. With ``valid``, only valid
+    nodes are read and invalid nodes are removed from lineages.
+    '''
+    with numpy.load(fname) as arrays:
+        def strings(name):
+            return unpack_strings(arrays[name], arrays[name + '_missing'])
+        tax_ids = strings('tax_id')
+        ranks = strings('ranks')
+        is_valid = arrays['is_valid']
+        codes = arrays['lineages']
+        rows = slice(None)
+        if valid:
+            mask_invalid(codes, is_valid)
+            rows = is_valid
+        index = pandas.Index(tax_ids[rows], name='tax_id')
+        taxtable = pandas.DataFrame(
+            {'parent_id': tax_ids[arrays['parent_id'][rows]],
+             'rank': ranks[arrays['rank'][rows]],
+             'tax_name': strings('tax_name')[rows],
+             'is_valid': is_valid[rows]},
+            index=index,
+            columns=['parent_id', 'rank', 'is_valid', 'tax_name'])
+        labels = numpy.append(tax_ids, numpy.nan)
+        lineages = pandas.DataFrame(
+            labels[codes[rows]],
+            index=index,
+            columns=strings('columns'))
+    return pandas.concat([taxtable, lineages], axis=1)
+
+
+def cached_taxtable(tax, ranks, cache_dir, valid=False):
+    '''
+    Return the full taxtable from cache_dir, building and caching it
+    first if the taxonomy in the database has changed. With ``valid``,
+    return only valid nodes (see read_cache).
+    '''
+    fingerprint = database_fingerprint(tax, ranks)
+    fname = os.path.join(cache_dir, 'taxtable-{}.npz'.format(fingerprint))
+    if os.path.exists(fname):
+        log.info('reading cached taxtable ' + fname)
+        return read_cache(fname, valid=valid)
+
+    taxtable = full_taxtable(tax.engine, tax.schema, ranks)
+    log.info('caching taxtable ' + fname)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    write_cache(taxtable, ranks, fname)
+    return read_cache(fname, valid=True) if valid else taxtable
+
+
+def subset_nodes(tax, tax_ids, chunksize=400):
+    '''
+    Return rows of the nodes table joined with primary tax_names for
+    tax_ids and all of their ancestors
+
+    Ancestors are resolved one level at a time, each level with a
+    query per chunk of up to ``chunksize`` tax_ids, so only the nodes
+    needed to build lineages for tax_ids are read from the database.
+    '''
+    nodes, names = tax.nodes, tax.names
+    frames = []
+    seen = set()
+    todo = set(tax_ids)
+    while todo:
+        seen.update(todo)
+        todo = sorted(todo)
+        level = []
+        for i in xrange(0, len(todo), chunksize):
+            s = sqlalchemy.select(
+                [nodes], nodes.c.tax_id.in_(todo[i:i + chunksize]))
+            level.append(pandas.read_sql(s, tax.engine, index_col='tax_id'))
+        level = pandas.concat(level)
+        frames.append(level)
+        todo = set(level['parent_id']) - seen
+    nodes = pandas.concat(frames)
+
+    tax_ids = nodes.index.tolist()
+    primaries = []
+    for i in xrange(0, len(tax_ids), chunksize):
+        s = sqlalchemy.select(
+            [names.c.tax_id, names.c.tax_name],
+            sqlalchemy.and_(names.c.tax_id.in_(tax_ids[i:i + chunksize]),
+                            names.c.is_primary))
+        primaries.append(pandas.read_sql(s, tax.engine, index_col='tax_id'))
+    nodes = nodes.join(pandas.concat(primaries)['tax_name'])
+    assert len(tax_ids) == len(nodes)
+
+    return nodes
+
+
+def build_taxtable(nodes, ranks, valid=False):
     '''
     Given list of tax_ids with parent_ids and an ordered list of ranks return
     a table of taxonomic lineages with ranks as columns
 
-    Iterate by rank starting with root and joining on parent_id to build
-    lineages.
+    Nodes are coded as integers and visited one level at a time starting
+    with the root. Each level copies the lineage rows of its parents in
+    a preallocated node by rank matrix and adds itself at its own rank.
+    Nodes not connected to the root are dropped. With ``valid``, invalid
+    nodes are dropped too and removed from the coded lineages of the
+    others.
     '''
-    df_index_name = nodes.index.name
-
-    nodes = nodes.join(nodes['rank'], on='parent_id', rsuffix='_parent').reset_index()
-    nodes['rank_parent'] = nodes['rank_parent'].astype('category', categories=ranks)
-    lineages = nodes[nodes['tax_id'] == '1'].iloc[[0]]
-    lineages.loc[:, 'root'] = lineages['tax_id']
-    nodes = nodes.drop(lineages.index)
-    tax_parent_groups = nodes.groupby(by='rank_parent', sort=True)
-    # standard message width so everything prints nice
-    msg = 'Processing lineages: {:<' + str(max(map(len, ranks))) + '}\r'
-    for parent, pdf in tax_parent_groups:
-        at_rank = []
-        for child, df in pdf.groupby(by='rank'):
-            df = df.copy()
-            df[child] = df['tax_id']
-            at_rank.append(df)
-        if at_rank:
-            '''bug in pandas 0.18.1 puts all categories as group
-               keys even when there are no values so we much test
-               for at_rank to be not empty'''
-            at_rank = pandas.concat(at_rank)
-            at_rank = at_rank.merge(
-                lineages[ranks[:ranks.index(parent) + 1]],
-                left_on='parent_id',
-                right_on=parent,
-                how='inner')
-            lineages = lineages.append(at_rank)
-
-        # status message
-        sys.stderr.write(msg.format(parent))
-
-    return lineages.drop('rank_parent', axis=1).set_index(df_index_name)
+    ranks = list(ranks)
+    tax_ids = nodes.index.values
+    node_count = len(tax_ids)
+    parents = nodes.index.get_indexer(nodes['parent_id'])
+    rank_codes = pandas.Categorical(nodes['rank'], categories=ranks).codes
+    if (rank_codes == -1).any():
+        unknown = set(nodes['rank'][rank_codes == -1])
+        raise ValueError('unknown ranks: ' + ', '.join(map(str, unknown)))
+
+    # children of each node are a contiguous block of ``by_parent``
+    by_parent = numpy.argsort(parents, kind='mergesort')
+    sorted_parents = parents[by_parent]
+
+    lineages = numpy.full((node_count, len(ranks)), -1, dtype=numpy.int32)
+    level = numpy.flatnonzero(parents == numpy.arange(node_count))  # root
+    lineages[level, rank_codes[level]] = level
+    reached = numpy.zeros(node_count, dtype=bool)
+    reached[level] = True
+
+    while len(level):
+        starts = numpy.searchsorted(sorted_parents, level, side='left')
+        counts = numpy.searchsorted(sorted_parents, level, side='right')
+        counts -= starts
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(
+            numpy.cumsum(counts) - counts, counts)
+        level = by_parent[numpy.repeat(starts, counts) + offsets]
+        level = level[~reached[level]]
+        reached[level] = True
+        lineages[level] = lineages[parents[level]]
+        lineages[level, rank_codes[level]] = level
+        log.debug('{} lineages built'.format(reached.sum()))
+
+    if valid:
+        is_valid = nodes['is_valid'].values.astype(bool)
+        mask_invalid(lineages, is_valid)
+        reached &= is_valid
+
+    # represented ranks as columns, code -1 (no ancestor) becomes NaN
+    columns = numpy.unique(rank_codes[reached])
+    labels = numpy.append(tax_ids, numpy.nan).astype(object)
+    lineages = pandas.DataFrame(
+        labels[lineages[reached][:, columns]],
+        index=nodes.index[reached],
+        columns=[ranks[i] for i in columns])
+
+    return pandas.concat([nodes[reached], lineages], axis=1)
@@ -1,63 +1,150 @@
+import csv
 import itertools
 import sqlite3
 
+import numpy
 
-class OnUpdate(object):
 
-    def __init__(self, proxied):
-        self.proxied = proxied
-        self.setter = None
+def nested_set(parents):
+    """
+    Number the nodes of a forest for a nested set representation, in
+    which the descendants of each node are those with ``lft`` between
+    the node's ``lft`` and ``rgt``.
 
-    def __get__(self, inst, cls):
-        if inst is None:
-            return self
-        return getattr(inst, self.proxied)
+    ``parents`` holds the position of the parent of each node, or the
+    node's own position for a root. Returns lists ``lft`` and ``rgt``.
+    """
+    n = len(parents)
+    # children of each node as a linked list: first child and next sibling
+    first_child = [-1] * n
+    next_sibling = [-1] * n
+    for i in xrange(n - 1, -1, -1):
+        p = parents[i]
+        if p != i:
+            next_sibling[i] = first_child[p]
+            first_child[p] = i
 
-    def __set__(self, inst, value):
-        if self.setter:
-            self.setter(inst, value)
-        setattr(inst, self.proxied, value)
+    lft = [0] * n
+    rgt = [0] * n
+    counter = 1
+    for root in xrange(n):
+        if parents[root] != root:
+            continue
+        lft[root] = counter
+        counter += 1
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            child = first_child[node]
+            if child == -1:
+                rgt[node] = counter
+                counter += 1
+                stack.pop()
+            else:
+                first_child[node] = next_sibling[child]
+                lft[child] = counter
+                counter += 1
+                stack.append(child)
+    return lft, rgt
 
-    def __call__(self, f):
-        self.setter = f
-        return self
 
+def closure(lft, rgt):
+    """
+    Generate pairs ``(node, ancestor)`` of the positions of each node
+    and each of its ancestors (including the node itself) from the
+    nested set numbers returned by ``nested_set``.
+    """
+    # visit nodes in depth first order, keeping the current lineage
+    lineage = []
+    for i in sorted(xrange(len(lft)), key=lft.__getitem__):
+        while lineage and rgt[lineage[-1]] < lft[i]:
+            lineage.pop()
+        lineage.append(i)
+        for ancestor in lineage:
+            yield i, ancestor
 
-class _IntermediateTaxon(object):
 
-    def __init__(self, tax_id, parent, rank, tax_name):
-        self.children = set()
-        self.tax_id = tax_id
-        self.parent = parent
-        self.rank = rank
-        self.tax_name = tax_name
+class MrcaIndex(object):
+    """
+    In-memory index of a taxonomy answering most recent common ancestor
+    queries.
 
-    _parent = _adjacent_to = None
+    The LCA of a set of nodes is the LCA of the first and last of them
+    in depth first order. For two nodes ``u`` before ``v`` it is the
+    parent of the shallowest node after ``u`` up to and including
+    ``v``, found in constant time with a sparse table of range minima
+    over depths. A query for ``k`` tax_ids takes O(k) time.
+    """
 
-    @OnUpdate('_parent')
-    def parent(self, p):
-        if self.parent is not None:
-            self.parent.children.discard(self)
-        if p is not None:
-            p.children.add(self)
+    def __init__(self, tax_ids, parents):
+        """
+        ``tax_ids`` is a sequence of tax_ids and ``parents`` the
+        position of the parent of each, or its own position for a root.
+        """
+        lft, _ = nested_set(parents)
+        order = sorted(xrange(len(tax_ids)), key=lft.__getitem__)
+        # parents precede their children in depth first order
+        depth = [0] * len(tax_ids)
+        for i in order:
+            if parents[i] != i:
+                depth[i] = depth[parents[i]] + 1
 
-    @OnUpdate('_adjacent_to')
-    def adjacent_to(self, n):
-        if n is not None:
-            self.parent = n.parent
+        self.tax_ids = [tax_ids[i] for i in order]
+        self.positions = {tax_id: n for n, tax_id in enumerate(self.tax_ids)}
+        self.parents = [self.positions[tax_ids[parents[i]]] for i in order]
+        self.depths = numpy.array([depth[i] for i in order], dtype=numpy.int32)
 
-    def iterate_children(self, on_pop=None, including_self=True):
-        search_stack = [(None, set([self]))]
-        while search_stack:
-            if not search_stack[-1][1]:
-                parent, _ = search_stack.pop()
-                if on_pop:
-                    on_pop(parent)
-                continue
-            node = search_stack[-1][1].pop()
-            if node is not self or including_self:
-                yield node
-            search_stack.append((node, node.children.copy()))
+        # minima[j][n] is the position of the shallowest node among the
+        # 2 ** j nodes starting at n
+        self.minima = [numpy.arange(len(order), dtype=numpy.int32)]
+        width = 1
+        while width * 2 <= len(order):
+            prev = self.minima[-1]
+            a, b = prev[:-width], prev[width:]
+            self.minima.append(
+                numpy.where(self.depths[a] <= self.depths[b], a, b))
+            width *= 2
+
+    @classmethod
+    def from_taxtable(cls, fp):
+        """
+        Build an index from an open handle to a taxtable in csv format
+        with columns tax_id and parent_id
+        """
+        rows = csv.reader(fp)
+        header = next(rows)
+        tax_id_i, parent_i = header.index('tax_id'), header.index('parent_id')
+        tax_ids, parent_ids = [], []
+        for row in rows:
+            tax_ids.append(row[tax_id_i])
+            parent_ids.append(row[parent_i])
+        positions = {tax_id: i for i, tax_id in enumerate(tax_ids)}
+        return cls(tax_ids, [positions.get(parent_id, i)
+                             for i, parent_id in enumerate(parent_ids)])
+
+    def mrca(self, tax_ids):
+        """
+        Return the most recent common ancestor of ``tax_ids`` or None if
+        there is none or any of them is unknown.
+        """
+        try:
+            positions = [self.positions[t] for t in tax_ids]
+        except KeyError:
+            return None
+        if not positions:
+            return None
+        first, last = min(positions), max(positions)
+        if first == last:
+            return self.tax_ids[first]
+        start, end = first + 1, last + 1
+        j = (end - start).bit_length() - 1
+        a = self.minima[j][start]
+        b = self.minima[j][end - (1 << j)]
+        shallowest = a if self.depths[a] <= self.depths[b] else b
+        if self.depths[shallowest] == 0:
+            # a root: the nodes are in different trees
+            return None
+        return self.tax_ids[self.parents[shallowest]]
 
 
 class Taxdb(object):
@@ -98,11 +185,14 @@ class Taxdb(object):
         curs.execute("""
             CREATE TABLE hierarchy (
               tax_id TEXT REFERENCES taxa (tax_id) PRIMARY KEY NOT NULL,
-              lft INT NOT NULL UNIQUE,
-              rgt INT NOT NULL UNIQUE
+              lft INT NOT NULL,
+              rgt INT NOT NULL
             )
         """)
 
+        # each tax_id with each of its ancestors, including itself;
+        # descendants of a parent are a range of the lft index, but
+        # ancestors of a child are not (see create_closure)
         curs.execute("""
             CREATE VIEW parents AS
             SELECT h1.tax_id AS child,
@@ -115,29 +205,53 @@ class Taxdb(object):
     def insert_from_taxtable(self, fieldnames_cb, table):
         curs = self.db.cursor()
 
-        taxon_map = {}
+        tax_ids, parent_ids, ranks, tax_names = [], [], [], []
         for row in table:
-            parent = taxon_map.get(row['parent_id'])
-            taxon = _IntermediateTaxon(
-                row['tax_id'], parent, row['rank'], row['tax_name'])
-            taxon_map[taxon.tax_id] = taxon
-
-        root = next(taxon_map.itervalues())
-        while root.parent is not None:
-            root = root.parent
-        counter = itertools.count(1).next
-
-        def on_pop(parent):
-            if parent is not None:
-                parent.rgt = counter()
-        for node in root.iterate_children(on_pop=on_pop):
-            node.lft = counter()
+            tax_ids.append(row['tax_id'])
+            parent_ids.append(row['parent_id'])
+            ranks.append(row['rank'])
+            tax_names.append(row['tax_name'])
+
+        # nodes with a missing parent are roots
+        positions = {tax_id: i for i, tax_id in enumerate(tax_ids)}
+        parents = [positions.get(parent_id, i)
+                   for i, parent_id in enumerate(parent_ids)]
+        lft, rgt = nested_set(parents)
 
         fieldnames = fieldnames_cb()
         curs.executemany("INSERT INTO ranks (rank_order, rank) VALUES (?, ?)",
                          enumerate(fieldnames[4:]))
         curs.executemany("INSERT INTO taxa VALUES (?, ?, ?)",
-                         ((t.tax_id, t.tax_name, t.rank) for t in taxon_map.itervalues()))
+                         itertools.izip(tax_ids, tax_names, ranks))
         curs.executemany("INSERT INTO hierarchy VALUES (?, ?, ?)",
-                         ((t.tax_id, t.lft, t.rgt) for t in taxon_map.itervalues()))
+                         itertools.izip(tax_ids, lft, rgt))
+        # indexes are faster to build after loading than to maintain
+        curs.execute("CREATE UNIQUE INDEX IF NOT EXISTS "
+                     "hierarchy_lft ON hierarchy (lft)")
+        curs.execute("CREATE UNIQUE INDEX IF NOT EXISTS "
+                     "hierarchy_rgt ON hierarchy (rgt)")
+        self.db.commit()
+
+    def create_closure(self):
+        """
+        Replace the ``parents`` view with a table of each tax_id and
+        each of its ancestors indexed by child, for queries joining many
+        tax_ids to their ancestors. The table has a row per node per
+        ancestor, so it is only built when needed.
+        """
+        curs = self.db.cursor()
+        curs.execute("SELECT tax_id, lft, rgt FROM hierarchy")
+        tax_ids, lft, rgt = zip(*curs.fetchall()) or ((), (), ())
+        curs.execute("DROP VIEW parents")
+        curs.execute("""
+            CREATE TABLE parents (
+              child TEXT REFERENCES taxa (tax_id) NOT NULL,
+              parent TEXT REFERENCES taxa (tax_id) NOT NULL
+            )
+        """)
+        curs.executemany("INSERT INTO parents VALUES (?, ?)",
+                         ((tax_ids[i], tax_ids[a])
+                          for i, a in closure(lft, rgt)))
+        curs.execute("CREATE UNIQUE INDEX parents_child "
+                     "ON parents (child, parent)")
         self.db.commit()
@@ -16,17 +16,36 @@
 The Taxonomy class defines an object providing an interface to
 the taxonomy database.
 """
+import copy
 import csv
 import itertools
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 
 import sqlalchemy
 from sqlalchemy import MetaData, and_, or_
+from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import select
 
+from taxtastic.ncbi import define_schema
+
 log = logging.getLogger(__name__)
 
 
+# keys: schema
+# vals: unbound table definitions from ncbi.define_schema
+_schemas = {}
+
+
+def _schema_tables(schema):
+    if schema not in _schemas:
+        base = declarative_base(metadata=MetaData(schema=schema))
+        define_schema(base)
+        _schemas[schema] = base.metadata.sorted_tables
+    return _schemas[schema]
+
+
 class TaxonIntegrityError(Exception):
     '''
     Raised when something in the Taxonomy is not structured correctly
@@ -56,16 +75,27 @@ class Taxonomy(object):
         >>> engine = create_engine(url)
         >>> tax = Taxonomy(engine)
 
-        see http://www.sqlalchemy.org/docs/reference/sqlalchemy/inspector.html
-        http://www.sqlalchemy.org/docs/metadata.html#metadata-reflection
+        Table definitions come from ``ncbi.define_schema``; ranks and
+        the optional taxonomy table are only read from the database
+        when first needed.
+
+        A Taxonomy may be shared by multiple threads. Each query checks
+        out its own connection from the engine's pool, cached lineages
+        and ranks are read without locking and are only ever replaced,
+        never modified in place, while holding ``self.lock``.
         """
 
         log.debug('using database ' + str(engine.url))
 
         self.engine = engine
+        self.schema = schema
+
+        # table definitions are known in advance so there is no need to
+        # reflect the (possibly large) database schema
         self.meta = MetaData(schema=schema)
         self.meta.bind = self.engine
-        self.meta.reflect()
+        for table in _schema_tables(schema):
+            table.tometadata(self.meta)
 
         schema_prefix = schema + '.' if schema else ''
 
@@ -73,18 +103,21 @@ class Taxonomy(object):
         self.names = self.meta.tables[schema_prefix + 'names']
         self.source = self.meta.tables[schema_prefix + 'source']
         self.merged = self.meta.tables[schema_prefix + 'merged']
-        ranks = select([self.meta.tables[schema_prefix + 'ranks'].c.rank]).execute().fetchall()
-        self.ranks = [r[0] for r in ranks]
+        self.ranks_table = self.meta.tables[schema_prefix + 'ranks']
 
-        if 'taxonomy' in self.meta.tables:
-            self.taxonomy = self.meta.tables[schema_prefix + 'taxonomy']
-        else:
-            self.taxonomy = None
+        # loaded on first use; see the ranks and taxonomy properties
+        self._ranks = None
+        self._taxonomy = None
+        self._taxonomy_ranks = []
+        self._taxonomy_reflected = False
 
         # keys: tax_id
         # vals: lineage represented as a list of tuples: (rank, tax_id)
         self.cached = {}
 
+        # serializes lazy loading, cache fills and updates to self.ranks
+        self.lock = threading.RLock()
+
         # keys: tax_id
         # vals: lineage represented as a dict of {rank:tax_id}
         # self.taxa = {}
@@ -92,13 +125,61 @@ class Taxonomy(object):
         self.NO_RANK = NO_RANK
         self.undef_prefix = undef_prefix
 
+    @property
+    def ranks(self):
+        if self._ranks is None:
+            with self.lock:
+                if self._ranks is None:
+                    s = select([self.ranks_table.c.rank])
+                    self.ranks = [r[0] for r in s.execute().fetchall()]
+        return self._ranks
+
+    @ranks.setter
+    def ranks(self, ranks):
+        self._ranks = ranks
+        self._rankset = frozenset(ranks)
+
+    @property
+    def rankset(self):
+        self.ranks
+        return self._rankset
+
+    @property
+    def taxonomy(self):
+        """
+        Optional table of materialized lineages (see ``taxit
+        new_database --taxonomy-table``) with one column per rank from
+        the root down, or None. Reflected on first use.
+        """
+        if not self._taxonomy_reflected:
+            with self.lock:
+                if not self._taxonomy_reflected:
+                    if self.engine.has_table('taxonomy', schema=self.schema):
+                        self._taxonomy = sqlalchemy.Table(
+                            'taxonomy', self.meta, autoload=True)
+                        self._taxonomy_ranks = [
+                            c.name for c in self._taxonomy.c if c.name not in
+                            ('tax_id', 'parent_id', 'rank', 'tax_name')]
+                    self._taxonomy_reflected = True
+        return self._taxonomy
+
+    @property
+    def taxonomy_ranks(self):
+        self.taxonomy
+        return self._taxonomy_ranks
+
     def _add_rank(self, rank, parent_rank):
         """
         inserts rank into self.ranks.
+
+        self.ranks and self.rankset are replaced rather than modified
+        so concurrent readers always see a consistent list.
         """
-        if rank not in self.rankset:
-            self.ranks.insert(self.ranks.index(parent_rank) + 1, rank)
-        self.rankset = set(self.ranks)
+        with self.lock:
+            if rank not in self.rankset:
+                ranks = list(self.ranks)
+                ranks.insert(ranks.index(parent_rank) + 1, rank)
+                self.ranks = ranks
 
     def _node(self, tax_id):
         """
@@ -186,9 +267,22 @@ class Taxonomy(object):
 
         return output
 
+    def _taxonomy_lineage(self, tax_id):
+        """
+        Returns lineage of tax_id from its row in the taxonomy table
+        or None if tax_id is not in the table.
+        """
+        s = select([self.taxonomy.c[r] for r in self.taxonomy_ranks],
+                   self.taxonomy.c.tax_id == tax_id)
+        output = s.execute().fetchone()
+        if not output:
+            return None
+        return [(r, t) for r, t in zip(self.taxonomy_ranks, output) if t]
+
     def _get_lineage(self, tax_id, _level=0, merge_obsolete=True):
         """
-        Returns cached lineage from self.cached or recursively builds
+        Returns cached lineage from self.cached, the lineage stored in
+        the taxonomy table if there is one or recursively builds
         lineage of tax_id until the root node is reached.
 
         SIDE EFFECT: Updates self.ranks with unknown or 'no_rank' designations
@@ -202,6 +296,12 @@ class Taxonomy(object):
 
         lineage = self.cached.get(tax_id)
 
+        if not lineage and self.taxonomy is not None:
+            lineage = self._taxonomy_lineage(tax_id)
+            if lineage:
+                with self.lock:
+                    self.cached[tax_id] = lineage
+
         if lineage:
             log.debug('{} tax_id "{}" is cached'.format(indent, tax_id))
         else:
@@ -225,7 +325,8 @@ class Taxonomy(object):
                     self._add_rank(_rank, _parent_rank)
 
                     lineage[i] = (_rank, _tax_id)
-                    self.cached[_tax_id] = lineage
+                    with self.lock:
+                        self.cached[_tax_id] = lineage[:i + 1]
                     msg = ('renamed undefined rank to {} in '
                            'element {} of lineage of {}')
                     msg = msg.format(_rank, i, tax_id)
@@ -233,7 +334,8 @@ class Taxonomy(object):
 
                 _parent_rank = _rank
 
-            self.cached[tax_id] = lineage
+            with self.lock:
+                self.cached[tax_id] = lineage
 
         return lineage
 
@@ -274,6 +376,38 @@ class Taxonomy(object):
 
         return output
 
+    def bulk_synonyms(self, tax_ids=(), tax_names=(), chunksize=400):
+        """
+        Return all names of many taxa as a dict of {tax_id: [(tax_name,
+        is_primary), ...]}. Taxa are identified by tax_ids, by any of
+        their tax_names or both. Taxa that are not found are omitted.
+
+        Each chunk of up to ``chunksize`` tax_ids and ``chunksize``
+        tax_names is resolved with a single query. Lookups by tax_name
+        use index ix_names_tax_name, which ``ncbi.db_connect`` creates
+        with the names table; databases built before it was added to
+        the schema give the same results more slowly.
+        """
+        names = self.names
+        tax_ids, tax_names = list(set(tax_ids)), list(set(tax_names))
+
+        synonyms = {}
+        for i in xrange(0, max(len(tax_ids), len(tax_names)), chunksize):
+            ids = tax_ids[i:i + chunksize]
+            named = tax_names[i:i + chunksize]
+            clauses = []
+            if ids:
+                clauses.append(names.c.tax_id.in_(ids))
+            if named:
+                clauses.append(names.c.tax_id.in_(
+                    select([names.c.tax_id], names.c.tax_name.in_(named))))
+            s = select([names.c.tax_id, names.c.tax_name, names.c.is_primary],
+                       or_(*clauses))
+            for tax_id, tax_name, is_primary in s.execute():
+                synonyms.setdefault(tax_id, set()).add((tax_name, is_primary))
+
+        return dict((k, sorted(v)) for k, v in synonyms.iteritems())
+
     def ranksdict(self, tax_ids=[]):
         """
         return tax_id and rank in dictionary form. Can be limited with
@@ -323,8 +457,8 @@ class Taxonomy(object):
         """
 
         if not taxa:
-            taxa = self.cached.keys()
-            lin = self.cached.values()
+            with self.lock:
+                taxa, lin = zip(*self.cached.items()) or ([], [])
         else:
             lin = [self._get_lineage(tax_id) for tax_id in taxa]
 
@@ -393,19 +527,28 @@ class Taxonomy(object):
                 values={'parent_id': tax_id})
             ret.execute()
 
+        if children:
+            # lineages of the children have changed
+            with self.lock:
+                self.cached.clear()
+
         lineage = self.lineage(tax_id)
 
         log.debug(lineage)
 
         if self.taxonomy is not None:
-            self.taxonomy.insert().execute(
-                tax_id=tax_id, parent_id=parent_id, rank=rank, **lineage)
+            self.taxonomy.insert().execute(**lineage)
 
             for child in children:
-                c_rank = self.get_rank(child)
+                # the new node is now an ancestor of the child subtree
+                c_rank = self.rank(child)
+                ret = self.taxonomy.update(
+                    whereclause=self.taxonomy.c[c_rank] == child,
+                    values={rank: tax_id})
+                ret.execute()
                 ret = self.taxonomy.update(
-                    whereclause=getattr(self.taxonomy.c, c_rank) == child,
-                    values={c_rank: tax_id})
+                    whereclause=self.taxonomy.c.tax_id == child,
+                    values={'parent_id': tax_id})
                 ret.execute()
 
         return lineage
@@ -421,13 +564,37 @@ class Taxonomy(object):
         # drop columns not in nodes table
         values = dict(c for c in values.items() if c[0] in self.nodes.c)
 
+        _, old_rank = self._node(tax_id)
+
         self.nodes.update(
             whereclause=self.nodes.c.tax_id == tax_id,
             values=values).execute()
+
+        # parent_id or rank may have changed the lineages below tax_id
+        with self.lock:
+            self.cached.clear()
+        if self.taxonomy is not None:
+            self._update_taxonomy(tax_id, old_rank)
+
         lineage = self.lineage(tax_id)
         log.debug(lineage)
         return lineage
 
+    def _update_taxonomy(self, tax_id, rank):
+        """
+        Rebuild the taxonomy table rows of tax_id and all of its
+        descendants, where rank is the rank tax_id had when the rows
+        were last written.
+        """
+        subtree_clause = self.taxonomy.c[rank] == tax_id
+        s = select([self.taxonomy.c.tax_id], subtree_clause)
+        subtree = [t for t, in s.execute().fetchall()]
+
+        # lineages are rebuilt from nodes once the old rows are gone
+        self.taxonomy.delete(whereclause=subtree_clause).execute()
+        for t in subtree:
+            self.taxonomy.insert().execute(**self.lineage(t))
+
     def sibling_of(self, tax_id):
         """Return None or a tax_id of a sibling of *tax_id*.
 
@@ -564,3 +731,137 @@ class Taxonomy(object):
             newc = self.species_below(c)
             assert self.is_ancestor_of(newc, tax_id)
             return newc
+
+
+def _lineages(tax, tax_ids):
+    return [tax.lineage(tax_id) for tax_id in tax_ids]
+
+
+def _primaries_from_names(tax, tax_names):
+    return [tax.primary_from_name(tax_name) for tax_name in tax_names]
+
+
+def _copy_result(value):
+    """
+    Copy a query result and the values it contains so that callers
+    sharing a request cannot modify each other's results.
+    """
+    if isinstance(value, dict):
+        return {k: copy.copy(v) for k, v in value.iteritems()}
+    elif isinstance(value, list):
+        return [copy.copy(v) for v in value]
+    return copy.copy(value)
+
+
+class _SharedResult(object):
+    """
+    One caller's handle on an AsyncResult shared by identical requests.
+    ``get`` returns a copy of the result.
+    """
+
+    def __init__(self, result):
+        self._result = result
+
+    def get(self, timeout=None):
+        return _copy_result(self._result.get(timeout))
+
+    def wait(self, timeout=None):
+        self._result.wait(timeout)
+
+    def ready(self):
+        return self._result.ready()
+
+    def successful(self):
+        return self._result.successful()
+
+
+class AsyncTaxonomy(object):
+
+    def __init__(self, engine, processes=4, **kwargs):
+        """
+        Non-blocking interface to a taxonomy database. Queries run on
+        a bounded pool of worker threads, each with its own Taxonomy
+        instance, and return objects with the interface of
+        ``multiprocessing.pool.AsyncResult``. Concurrent identical
+        requests share a single query; each caller gets its own copy
+        of the result.
+
+        * engine - sqlalchemy engine instance (shared by all workers)
+        * processes - number of worker threads
+        * kwargs - additional arguments passed to Taxonomy
+
+        Example:
+        >>> with AsyncTaxonomy(engine) as tax:
+        ...     results = [tax.lineage(t) for t in tax_ids]
+        ...     lineages = [r.get() for r in results]
+        """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.pool = ThreadPool(processes, initializer=self._connect,
+                               initargs=(engine, kwargs))
+
+    def _connect(self, engine, kwargs):
+        self._local.taxonomy = Taxonomy(engine, **kwargs)
+
+    def _run(self, key, func, args):
+        try:
+            return func(self._local.taxonomy, *args)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _submit(self, func, *args):
+        """
+        Returns an AsyncResult for func(taxonomy, *args), reusing the
+        query of an identical request that has not yet completed.
+        """
+        key = (func, args)
+        with self._lock:
+            result = self._pending.get(key)
+            if result is None:
+                result = self.pool.apply_async(self._run, (key, func, args))
+                self._pending[key] = result
+        return _SharedResult(result)
+
+    def lineage(self, tax_id=None, tax_name=None):
+        return self._submit(Taxonomy.lineage, tax_id, tax_name)
+
+    def lineages(self, tax_ids):
+        """
+        Returns a single AsyncResult for a list of lineages
+        """
+        return self._submit(_lineages, tuple(tax_ids))
+
+    def primary_from_name(self, tax_name):
+        return self._submit(Taxonomy.primary_from_name, tax_name)
+
+    def primaries_from_names(self, tax_names):
+        """
+        Returns a single AsyncResult for a list of (tax_id, tax_name,
+        is_primary) tuples
+        """
+        return self._submit(_primaries_from_names, tuple(tax_names))
+
+    def synonyms(self, tax_id=None, tax_name=None):
+        return self._submit(Taxonomy.synonyms, tax_id, tax_name)
+
+    def bulk_synonyms(self, tax_ids=(), tax_names=()):
+        """
+        Returns a single AsyncResult for Taxonomy.bulk_synonyms
+        """
+        return self._submit(Taxonomy.bulk_synonyms,
+                            tuple(tax_ids), tuple(tax_names))
+
+    def close(self):
+        """
+        Wait for submitted queries to complete and stop the workers
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
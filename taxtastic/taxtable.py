@@ -17,27 +17,202 @@ Representation of a taxonomic hierarchy.
 """
 
 import collections
+import contextlib
 import csv
+import gc
+
+import numpy
+import pandas
+
+from taxtastic.utils import pack_strings, unpack_strings
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    Pause cyclic garbage collection, which otherwise runs over and over
+    while many nodes are created and finds nothing to collect.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# shared by nodes without children or sequences
+_EMPTY = frozenset()
+
+# one string per distinct rank name, shared by all nodes of that rank
+_RANKS = {}
+
+
+class _NodeSet(set):
+    """
+    Set of the children or sequence IDs of a node, as returned by
+    TaxNode.children and TaxNode.sequence_ids.
+
+    Modifying the set forgets the cached sequence counts of the node and
+    its ancestors. Nodes without children or sequences have no set; the
+    empty set returned for them becomes the node's set when something is
+    first added to it.
+    """
+
+    __slots__ = ('_node', '_attr')
+
+    def __init__(self, node, attr, items=()):
+        set.__init__(self, items)
+        self._node = node
+        self._attr = attr
+
+    def __reduce__(self):
+        # pickled and copied as a plain set
+        return set, (list(self),)
+
+    def __repr__(self):
+        return repr(set(self))
+
+    def _modify(self):
+        node = self._node
+        node._invalidate()
+        if getattr(node, self._attr) is None:
+            setattr(node, self._attr, self)
+
+
+def _modifier(name):
+    method = getattr(set, name)
+
+    def modify(self, *args):
+        self._modify()
+        return method(self, *args)
+    modify.__name__ = name
+    modify.__doc__ = method.__doc__
+    return modify
+
+
+for _name in ['add', 'clear', 'difference_update', 'discard',
+              'intersection_update', 'pop', 'remove',
+              'symmetric_difference_update', 'update',
+              '__iand__', '__ior__', '__isub__', '__ixor__']:
+    setattr(_NodeSet, _name, _modifier(_name))
+
+
+def _node_matcher(condition):
+    """
+    Return a function of a node for ``condition``, which is either a
+    function of a node or the name of a rank
+    """
+    if callable(condition):
+        return condition
+    return lambda node: node.rank == condition
 
 
 class TaxNode(object):
     """
     Taxonomic tree, with optional sequence IDs on nodes.
+
+    Nodes have no instance dictionary, share a single string per rank
+    name, and only allocate sets of children and sequence_ids once
+    these are used, since most nodes of a large tree are leaves without
+    sequences.
+
+    The number of sequences in the subtree below each node is cached by
+    :meth:`subtree_sequence_count` and forgotten for a node and its
+    ancestors whenever the node's children or sequence_ids change.
     """
 
+    __slots__ = ('ranks', 'rank', 'name', 'tax_id', 'parent', 'index',
+                 '_children', '_sequence_ids', '_count')
+
     def __init__(self, rank, tax_id, parent=None, sequence_ids=None,
                  children=None, name=None, ranks=None):
         self.ranks = ranks
-        self.rank = rank
+        self.rank = _RANKS.setdefault(rank, rank)
         self.name = name
         self.tax_id = tax_id
         self.parent = parent
-        self.sequence_ids = sequence_ids or set()
-        self.children = children or set()
+        self._sequence_ids = self._own('_sequence_ids', sequence_ids)
+        self._children = self._own('_children', children)
+        self._count = None
         assert tax_id != ""
 
-        if self.is_root:
-            self.index = {self.tax_id: self}
+        self.index = {self.tax_id: self} if self.is_root else None
+
+    @property
+    def children(self):
+        """
+        Set of child nodes
+        """
+        if self._children is None:
+            return _NodeSet(self, '_children')
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._invalidate()
+        self._children = self._own('_children', value)
+
+    @property
+    def sequence_ids(self):
+        """
+        Set of sequence IDs at this node
+        """
+        if self._sequence_ids is None:
+            return _NodeSet(self, '_sequence_ids')
+        return self._sequence_ids
+
+    @sequence_ids.setter
+    def sequence_ids(self, value):
+        self._invalidate()
+        self._sequence_ids = self._own('_sequence_ids', value)
+
+    def _own(self, attr, items):
+        """
+        Return ``items`` as the set stored in ``attr``, or None if empty
+        """
+        if not items:
+            return None
+        if isinstance(items, _NodeSet) and items._node is self:
+            if items._attr == attr:
+                return items
+        return _NodeSet(self, attr, items)
+
+    def _invalidate(self):
+        """
+        Forget cached sequence counts of this node and its ancestors.
+        A node has no count unless all nodes below it have counts, so
+        this can stop at the first node without one.
+        """
+        node = self
+        while node is not None and node._count is not None:
+            node._count = None
+            node = node.parent
+
+    def subtree_sequence_count(self):
+        """
+        Number of sequence IDs at or below this node.
+
+        Counts are computed for all nodes below this one in a single
+        post-order traversal (skipping subtrees already counted) and
+        cached until the tree is modified, so counting every node of a
+        tree takes linear time.
+        """
+        if self._count is None:
+            stack = [(self, iter(self._children or _EMPTY))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child._count is None:
+                        stack.append(
+                            (child, iter(child._children or _EMPTY)))
+                        break
+                else:
+                    stack.pop()
+                    node._count = len(node._sequence_ids or _EMPTY) + sum(
+                        c._count for c in node._children or _EMPTY)
+        return self._count
 
     def add_child(self, child):
         """
@@ -49,14 +224,27 @@ class TaxNode(object):
         child.index = self.index
         assert child.tax_id not in self.index
         self.index[child.tax_id] = child
-        self.children.add(child)
+        self._invalidate()
+        if self._children is None:
+            self._children = _NodeSet(self, '_children')
+        set.add(self._children, child)
+
+    def add_sequence(self, *sequence_ids):
+        """
+        Add sequence IDs to this node.
+        """
+        self._invalidate()
+        if self._sequence_ids is None:
+            self._sequence_ids = _NodeSet(self, '_sequence_ids')
+        set.update(self._sequence_ids, sequence_ids)
 
     def remove_child(self, child):
         """
         Remove a child from this node.
         """
-        assert child in self.children
-        self.children.remove(child)
+        assert child in (self._children or _EMPTY)
+        self._invalidate()
+        self._children.remove(child)
         self.index.pop(child.tax_id)
         if child.parent is self:
             child.parent = None
@@ -83,13 +271,15 @@ class TaxNode(object):
             raise ValueError("Cannot drop root node!")
 
         parent = self.parent
-        for child in self.children:
+        # parent has children (this node), so its set exists
+        for child in self._children or _EMPTY:
             child.parent = parent
-            parent.children.add(child)
-        self.children = set()
+            parent._children.add(child)
+        self._children = None
 
-        parent.sequence_ids.update(self.sequence_ids)
-        self.sequence_ids = set()
+        if self._sequence_ids:
+            parent.add_sequence(*self._sequence_ids)
+        self._sequence_ids = None
 
         parent.remove_child(self)
 
@@ -97,15 +287,66 @@ class TaxNode(object):
         """
         Remove nodes without sequences or children below this node.
         """
+        index = self.index
         for node in self.depth_first_iter(self_first=False):
-            if (not node.children and
-                    not node.sequence_ids and
+            if (not node._children and
+                    not node._sequence_ids and
                     node is not self):
-                node.parent.remove_child(node)
+                node.parent._children.remove(node)
+                index.pop(node.tax_id)
+                node.parent = node.index = None
+
+    def _outermost(self, match):
+        """
+        Generate nodes at or below this node for which ``match`` is true
+        but not the nodes below them.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if match(node):
+                yield node
+            else:
+                stack.extend(node._children or _EMPTY)
+
+    def prune_nodes(self, condition):
+        """
+        Remove the subtrees below this node rooted at nodes matching
+        ``condition``, either a rank or a function of a node.
+        """
+        match = _node_matcher(condition)
+        for node in self._outermost(lambda n: n is not self and match(n)):
+            node.parent.remove_child(node)
+
+    def collapse_nodes(self, condition, remove=False):
+        """
+        Collapse (see :meth:`collapse`) each node at or below this node
+        matching ``condition``, either a rank or a function of a node.
+        Nodes below a matching node are collapsed along with it.
+
+        For example, ``root.collapse_nodes('genus', remove=True)``
+        moves all sequences of species to their genus and removes the
+        species.
+        """
+        for node in self._outermost(_node_matcher(condition)):
+            node.collapse(remove)
+
+    def drop_nodes(self, condition):
+        """
+        Drop (see :meth:`drop`) each node below this node matching
+        ``condition``, either a rank or a function of a node.
+        """
+        match = _node_matcher(condition)
+        stack = list(self._children or _EMPTY)
+        while stack:
+            node = stack.pop()
+            stack.extend(node._children or _EMPTY)
+            if match(node):
+                node.drop()
 
     @property
     def is_leaf(self):
-        return not self.children
+        return not self._children
 
     @property
     def is_root(self):
@@ -127,21 +368,38 @@ class TaxNode(object):
         """
         Iterate over nodes below this node, optionally yielding children before
         self.
+
+        The children of each node are listed when the node is reached, so
+        the tree may be modified during iteration.
         """
         if self_first:
             yield self
-        for child in list(self.children):
-            for i in child.depth_first_iter(self_first):
-                yield i
-        if not self_first:
-            yield self
+            stack = [iter(list(self._children or _EMPTY))]
+            while stack:
+                for node in stack[-1]:
+                    yield node
+                    stack.append(iter(list(node._children or _EMPTY)))
+                    break
+                else:
+                    stack.pop()
+        else:
+            stack = [(self, iter(list(self._children or _EMPTY)))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    stack.append(
+                        (child, iter(list(child._children or _EMPTY))))
+                    break
+                else:
+                    stack.pop()
+                    yield node
 
     def subtree_sequence_ids(self):
         """
         Generate all sequence IDs at or below this node.
         """
         for node in self:
-            for s in node.sequence_ids:
+            for s in node._sequence_ids or _EMPTY:
                 yield s
 
     def remove_subtree(self):
@@ -156,16 +414,15 @@ class TaxNode(object):
     def path(self, tax_ids):
         """Get the node at the end of the path described by tax_ids."""
         assert tax_ids[0] == self.tax_id
-        if len(tax_ids) == 1:
-            return self
+        node = self
+        for n in tax_ids[1:]:
+            try:
+                node = next(i for i in node._children or _EMPTY
+                            if i.tax_id == n)
+            except StopIteration:
+                raise ValueError(n)
 
-        n = tax_ids[1]
-        try:
-            child = next(i for i in self.children if i.tax_id == n)
-        except StopIteration:
-            raise ValueError(n)
-
-        return child.path(tax_ids[1:])
+        return node
 
     def get_node(self, tax_id):
         """
@@ -177,56 +434,110 @@ class TaxNode(object):
         """
         Return all nodes between this node and the root, including this one.
         """
-        if not self.parent:
-            return [self]
-        else:
-            l = self.parent.lineage()
-            l.append(self)
-            return l
+        l = []
+        node = self
+        while node is not None:
+            l.append(node)
+            node = node.parent
+        l.reverse()
+        return l
 
     def __repr__(self):
         return ("<TaxNode {0.tax_id}:{0.name} [rank={0.rank};"
                 "children={1};sequences={2}]>").format(
-            self, len(self.children), len(self.sequence_ids))
+            self, len(self._children or _EMPTY),
+            len(self._sequence_ids or _EMPTY))
 
     def __iter__(self):
         return self.depth_first_iter()
 
+    def __getstate__(self):
+        # needed to pickle with protocols 0 and 1, since there is no
+        # __dict__; cached counts are not kept
+        return dict((name, getattr(self, name))
+                    for name in self.__slots__ if name != '_count')
+
+    def __setstate__(self, state):
+        self._count = None
+        for name, value in state.iteritems():
+            if name == 'rank':
+                value = _RANKS.setdefault(value, value)
+            elif name in ('_children', '_sequence_ids'):
+                value = self._own(name, value)
+            setattr(self, name, value)
+
     def write_taxtable(self, out_fp, **kwargs):
         """
         Write a taxtable for this node and all descendants,
         including the lineage leading to this node.
+
+        Rows are written in a single depth first traversal in which each
+        node extends the lineage of its parent.
         """
+        ancestors = self.lineage()[:-1]
         ranks_represented = frozenset(i.rank for i in self) | \
-            frozenset(i.rank for i in self.lineage())
+            frozenset(i.rank for i in ancestors)
         ranks = [i for i in self.ranks if i in ranks_represented]
         assert len(ranks_represented) == len(ranks)
+        positions = {rank: i for i, rank in enumerate(ranks)}
 
-        def node_record(node):
+        def extend(lineage, node):
+            lineage = list(lineage)
+            lineage[positions[node.rank]] = node.tax_id
+            return lineage
+
+        def node_record(node, lineage):
             parent_id = node.parent.tax_id if node.parent else node.tax_id
-            d = {'tax_id': node.tax_id,
-                 'tax_name': node.name,
-                 'parent_id': parent_id,
-                 'rank': node.rank}
-            l = {i.rank: i.tax_id for i in node.lineage()}
-            d.update(l)
-            return d
+            return [node.tax_id, parent_id, node.rank, node.name] + lineage
+
+        def records():
+            # All nodes leading to this one
+            lineage = [''] * len(ranks)
+            for node in ancestors:
+                lineage = extend(lineage, node)
+                yield node_record(node, lineage)
+            # this node and descendants
+            stack = [(iter([self]), lineage)]
+            while stack:
+                nodes, lineage = stack[-1]
+                for node in nodes:
+                    node_lineage = extend(lineage, node)
+                    yield node_record(node, node_lineage)
+                    stack.append(
+                        (iter(list(node._children or _EMPTY)), node_lineage))
+                    break
+                else:
+                    stack.pop()
 
         header = ['tax_id', 'parent_id', 'rank', 'tax_name'] + ranks
-        w = csv.DictWriter(out_fp, header, quoting=csv.QUOTE_NONNUMERIC,
-                           lineterminator='\n')
-        w.writeheader()
-        # All nodes leading to this one
-        for i in self.lineage()[:-1]:
-            w.writerow(node_record(i))
-        w.writerows(node_record(i) for i in self)
-
-    def populate_from_seqinfo(self, seqinfo):
-        """Populate sequence_ids below this node from a seqinfo file object."""
-        for row in csv.DictReader(seqinfo):
-            node = self.index.get(row['tax_id'])
-            if node:
-                node.sequence_ids.add(row['seqname'])
+        w = csv.writer(out_fp, quoting=csv.QUOTE_NONNUMERIC,
+                       lineterminator='\n')
+        w.writerow(header)
+        w.writerows(records())
+
+    def populate_from_seqinfo(self, seqinfo, chunksize=1000000):
+        """
+        Populate sequence_ids below this node from a seqinfo file object.
+
+        Only columns seqname and tax_id are read, ``chunksize`` rows at a
+        time, and the seqnames of each tax_id in a chunk are added to its
+        node at once.
+        """
+        index = self.index
+        chunks = pandas.read_csv(
+            seqinfo, usecols=['seqname', 'tax_id'], dtype=str,
+            na_filter=False, chunksize=chunksize)
+        for chunk in chunks:
+            # group rows by tax_id
+            codes, tax_ids = pandas.factorize(chunk['tax_id'].values)
+            order = codes.argsort(kind='mergesort')
+            seqnames = chunk['seqname'].values[order]
+            bounds = numpy.searchsorted(
+                codes[order], numpy.arange(len(tax_ids) + 1)).tolist()
+            for tax_id, start, end in zip(tax_ids, bounds[:-1], bounds[1:]):
+                node = index.get(tax_id)
+                if node:
+                    node.add_sequence(*seqnames[start:end])
 
     def collapse(self, remove=False):
         """
@@ -235,16 +546,24 @@ class TaxNode(object):
         If ``remove`` is True, nodes below this one are deleted from the
         taxonomy.
         """
+        index = self.index
         descendants = iter(self)
         # Skip this node
         assert next(descendants) is self
         for descendant in descendants:
-            self.sequence_ids.update(descendant.sequence_ids)
-            descendant.sequence_ids.clear()
+            if descendant._sequence_ids:
+                self.add_sequence(*descendant._sequence_ids)
+                descendant._sequence_ids = None
+            descendant._count = None
+            if remove:
+                index.pop(descendant.tax_id)
+                descendant.index = None
 
         if remove:
-            for node in self.children:
-                self.remove_child(node)
+            for child in self._children or _EMPTY:
+                child.parent = None
+            self._children = None
+        self._invalidate()
 
     def write_seqinfo(self, out_fp, include_name=True):
         """
@@ -267,7 +586,7 @@ class TaxNode(object):
                  'tax_id': node.tax_id,
                  'tax_name': node.name}
                 for node in self
-                for seq_id in node.sequence_ids)
+                for seq_id in node._sequence_ids or _EMPTY)
 
         w.writerows(rows)
 
@@ -275,56 +594,154 @@ class TaxNode(object):
     def from_taxtable(cls, taxtable_fp):
         """
         Generate a node from an open handle to a taxtable, as generated by
-        ``taxit taxtable``
+        ``taxit taxtable``, in csv or one of COLUMNAR_FORMATS
         """
-        r = csv.reader(taxtable_fp)
-        headers = next(r)
-        rows = (collections.OrderedDict(zip(headers, i)) for i in r)
+        if columnar_format(taxtable_fp):
+            taxtable = read_table(taxtable_fp).fillna('')
+            headers = taxtable.columns.tolist()
+            rows = taxtable.itertuples(index=False)
+        else:
+            rows = csv.reader(taxtable_fp)
+            headers = next(rows)
+        tax_id_i, rank_i, name_i = [
+            headers.index(i) for i in ('tax_id', 'rank', 'tax_name')]
+        path_root = headers.index('root')
 
         row = next(rows)
-        root = cls(rank=row['rank'], tax_id=row[
-                   'tax_id'], name=row['tax_name'])
-        path_root = headers.index('root')
+        root = cls(rank=row[rank_i], tax_id=row[tax_id_i], name=row[name_i])
         root.ranks = headers[path_root:]
-        for row in rows:
-            rank, tax_id, name = [
-                row[i] for i in ('rank', 'tax_id', 'tax_name')]
-            path = filter(None, row.values()[path_root:])
-            parent = root.path(path[:-1])
-            parent.add_child(cls(rank, tax_id, name=name))
+        index = root.index
+        with _gc_paused():
+            for row in rows:
+                # parent is the last node in the lineage before this one
+                path = [i for i in row[path_root:] if i]
+                try:
+                    parent = index[path[-2]]
+                except (IndexError, KeyError):
+                    raise ValueError(row[tax_id_i])
+                parent.add_child(
+                    cls(row[rank_i], row[tax_id_i], name=row[name_i]))
 
         return root
 
+    def write_binary(self, out_fp):
+        """
+        Write this node and all descendants, including names and
+        sequence_ids, in a binary format read by :meth:`from_binary`.
+
+        The tree is stored as a numpy .npz archive of node arrays in
+        depth first order with the position of each parent.
+        """
+        nodes = list(self)
+        positions = {node.tax_id: i for i, node in enumerate(nodes)}
+        ranks = list(self.ranks or [])
+        ranks.extend(r for r in collections.OrderedDict.fromkeys(
+            node.rank for node in nodes) if r not in ranks)
+        rank_codes = {r: i for i, r in enumerate(ranks)}
+        sequences = [(i, s) for i, node in enumerate(nodes)
+                     for s in sorted(node._sequence_ids or _EMPTY)]
+
+        arrays = {
+            'parent': numpy.array(
+                [-1] + [positions[n.parent.tax_id] for n in nodes[1:]],
+                dtype=numpy.int32),
+            'rank': numpy.array([rank_codes[n.rank] for n in nodes],
+                                dtype=numpy.int16),
+            'sequence_node': numpy.array([i for i, _ in sequences],
+                                         dtype=numpy.int32),
+            'has_ranks': numpy.array(self.ranks is not None)}
+        for name, values in [('tax_id', [n.tax_id for n in nodes]),
+                             ('name', [n.name for n in nodes]),
+                             ('ranks', ranks),
+                             ('sequence_id', [s for _, s in sequences])]:
+            arrays[name], arrays[name + '_missing'] = pack_strings(values)
+        numpy.savez(out_fp, **arrays)
+
+    @classmethod
+    def from_binary(cls, fp):
+        """
+        Generate a node from a file name or an open handle to a tree
+        written by :meth:`write_binary`
+        """
+        with numpy.load(fp) as arrays:
+            # byte strings, as from_taxtable reads them
+            def strings(name):
+                return unpack_strings(
+                    arrays[name], arrays[name + '_missing'], decode=False)
+            # lists are much faster than arrays to index one at a time
+            tax_ids = strings('tax_id').tolist()
+            names = strings('name').tolist()
+            ranks = strings('ranks').tolist()
+            rank_of = [ranks[i] for i in arrays['rank'].tolist()]
+            parents = arrays['parent'].tolist()
+            sequence_nodes = arrays['sequence_node'].tolist()
+            sequence_ids = strings('sequence_id').tolist()
+            has_ranks = bool(arrays['has_ranks'])
+
+        nodes = [cls(rank_of[0], tax_ids[0], name=names[0],
+                     ranks=ranks if has_ranks else None)]
+        with _gc_paused():
+            for i in xrange(1, len(tax_ids)):
+                node = cls(rank_of[i], tax_ids[i], name=names[i])
+                nodes[parents[i]].add_child(node)
+                nodes.append(node)
+            for i, sequence_id in zip(sequence_nodes, sequence_ids):
+                nodes[i].add_sequence(sequence_id)
+
+        return nodes[0]
+
     @classmethod
     def from_taxdb(cls, con, root=None):
         """
-        Generate a TaxNode from a taxonomy database
+        Generate a TaxNode from a taxonomy database, including all nodes
+        if ``root`` is None or the subtree below tax_id ``root``.
+
+        Nodes are fetched in a single query (using a recursive common
+        table expression for a subtree) and assembled in memory.
         """
+        columns = """SELECT nodes.tax_id, parent_id, rank, tax_name
+                FROM {} LEFT JOIN names
+                    ON names.tax_id = nodes.tax_id AND names.is_primary = 1"""
         cursor = con.cursor()
         if root is None:
-            cursor.execute(
-                "SELECT tax_id, rank FROM nodes WHERE tax_id = parent_id")
+            cursor.execute(columns.format('nodes'))
         else:
+            subtree = """WITH RECURSIVE subtree(tax_id) AS (
+                    SELECT ?
+                    UNION ALL
+                    SELECT nodes.tax_id
+                    FROM nodes JOIN subtree
+                        ON nodes.parent_id = subtree.tax_id
+                    WHERE nodes.tax_id <> nodes.parent_id)
+                """
             cursor.execute(
-                "SELECT tax_id, rank FROM nodes WHERE tax_id = ?", [root])
-
-        tax_id, rank = cursor.fetchone()
-        root = cls(rank=rank, tax_id=tax_id)
-
-        def add_lineage(parent):
-            cursor.execute("""SELECT tax_id, rank, tax_name
-                    FROM nodes INNER JOIN names USING (tax_id)
-                    WHERE parent_id = :1 and tax_id <> :1
-                        AND names.is_primary = 1
-                    """, [parent.tax_id])
-            for tax_id, rank, name in cursor:
-                node = cls(rank=rank, tax_id=tax_id, name=name)
-                parent.add_child(node)
-            for child in parent.children:
-                add_lineage(child)
-
-        add_lineage(root)
-        return root
+                subtree + columns.format('subtree JOIN nodes USING (tax_id)'),
+                [root])
+
+        # rows of children by parent_id
+        children = collections.defaultdict(list)
+        top = None
+        for row in cursor:
+            tax_id, parent_id = row[:2]
+            if tax_id == root or (root is None and tax_id == parent_id):
+                top = row
+            else:
+                children[parent_id].append(row)
+        if top is None:
+            raise ValueError(root)
+
+        tax_id, _, rank, name = top
+        top = cls(rank=rank, tax_id=tax_id, name=name)
+        stack = [top]
+        with _gc_paused():
+            while stack:
+                parent = stack.pop()
+                for tax_id, _, rank, name in children.pop(parent.tax_id, ()):
+                    node = cls(rank=rank, tax_id=tax_id, name=name)
+                    parent.add_child(node)
+                    stack.append(node)
+
+        return top
 
 
 def read(fp):
@@ -333,3 +750,146 @@ def read(fp):
     Shortcut for :meth:`TaxNode.from_taxtable`.
     """
     return TaxNode.from_taxtable(fp)
+
+
+# file formats for taxtables besides csv and their magic numbers
+COLUMNAR_FORMATS = collections.OrderedDict([
+    ('parquet', 'PAR1'),
+    ('arrow', 'ARROW1')])
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa
+    except ImportError:
+        raise ImportError(
+            'pyarrow is required to read or write {} taxtables'.format(
+                ' or '.join(COLUMNAR_FORMATS)))
+    return pyarrow
+
+
+def columnar_format(source):
+    """
+    Return the name of the format of a taxtable file name or handle
+    from COLUMNAR_FORMATS or None for anything else (including
+    handles that cannot seek).
+    """
+    size = max(len(m) for m in COLUMNAR_FORMATS.values())
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            head = f.read(size)
+    else:
+        try:
+            pos = source.tell()
+            head = source.read(size)
+            source.seek(pos)
+        except (AttributeError, IOError):
+            return None
+    for name, magic in COLUMNAR_FORMATS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def write_table(taxtable, fname, fmt, ranks):
+    """
+    Write a taxtable data frame indexed by tax_id in one of
+    COLUMNAR_FORMATS.
+
+    Column rank is dictionary encoded with categories ``ranks``. The
+    tax_id index, parent_id and columns named for ranks hold tax_ids,
+    which are stored as integers unless any of them is not a decimal
+    number. Other columns are stored as strings.
+    """
+    pa = _pyarrow()
+    tax_ids = pandas.Series(taxtable.index, dtype=object)
+    integers = tax_ids.str.match(r'^(0|[1-9][0-9]*)$').all()
+    if integers:
+        int_type = numpy.int32
+        if tax_ids.astype(numpy.int64).max() > numpy.iinfo(int_type).max:
+            int_type = numpy.int64
+
+    def encode(column, values):
+        values = pandas.Series(numpy.asarray(values, dtype=object))
+        missing = values.isnull().values
+        if column == 'rank':
+            codes = pandas.Categorical(values, categories=ranks).codes
+            return pa.DictionaryArray.from_arrays(
+                pa.array(codes, mask=codes == -1),
+                pa.array(list(ranks), type=pa.string()))
+        elif integers and column in tax_id_columns:
+            return pa.array(
+                values.where(~missing, '0').values.astype(int_type),
+                mask=missing)
+        else:
+            return pa.array(values.values, type=pa.string(), from_pandas=True)
+
+    tax_id_columns = set(ranks) | {'tax_id', 'parent_id'}
+    names = ['tax_id'] + taxtable.columns.tolist()
+    arrays = [encode('tax_id', tax_ids)]
+    arrays.extend(encode(c, taxtable[c].values) for c in taxtable.columns)
+    table = pa.Table.from_arrays(arrays, names=names)
+
+    if fmt == 'parquet':
+        pa.parquet.write_table(table, fname)
+    elif fmt == 'arrow':
+        sink = pa.OSFile(fname, 'wb')
+        try:
+            writer = pa.RecordBatchFileWriter(sink, table.schema)
+            writer.write_table(table)
+            writer.close()
+        finally:
+            sink.close()
+    else:
+        raise ValueError('unknown taxtable format ' + fmt)
+
+
+def read_table(source):
+    """
+    Read a taxtable file name or handle in csv or one of
+    COLUMNAR_FORMATS into a data frame of strings, as read by
+    ``pandas.read_csv(source, dtype=str)``
+    """
+    fmt = columnar_format(source)
+    if fmt is None:
+        return pandas.read_csv(source, dtype=str)
+
+    pa = _pyarrow()
+    if fmt == 'parquet':
+        table = pa.parquet.read_table(source)
+    else:
+        if isinstance(source, basestring):
+            source = pa.memory_map(source)
+        table = pa.RecordBatchFileReader(source).read_all()
+
+    # integer tax_ids in other columns are mapped to the strings created
+    # for the tax_id column so each tax_id string exists only once
+    id_index = pandas.Index([], dtype=numpy.int64)
+    id_strings = numpy.array([numpy.nan], dtype=object)  # -1 is missing
+    columns = collections.OrderedDict()
+    for i, field in enumerate(table.schema):
+        values = table.column(i).to_pandas()
+        if pa.types.is_integer(field.type):
+            # missing values come back as NaN in a float column
+            ints = values.fillna(-1).values.astype(numpy.int64)
+            codes = id_index.get_indexer(ints)
+            strings = id_strings[codes]
+            unknown = (codes == -1) & (ints != -1)
+            strings[unknown] = ints[unknown].astype(str)
+            if field.name == 'tax_id':
+                id_index = pandas.Index(ints)
+                id_strings = numpy.append(strings, numpy.nan)
+        else:
+            # pyarrow returns unicode; encode each distinct value once
+            # so columns hold utf-8 str like those read from csv
+            if hasattr(values, 'cat'):
+                codes = values.cat.codes.values
+                uniques = values.cat.categories
+            else:
+                codes, uniques = pandas.factorize(values)
+            strings = numpy.array(
+                [u.encode('utf-8') if isinstance(u, unicode) else u
+                 for u in uniques] + [numpy.nan], dtype=object)[codes]
+        columns[field.name] = strings
+    return pandas.DataFrame(columns)
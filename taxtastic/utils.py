@@ -14,6 +14,7 @@
 #    along with taxtastic.  If not, see <http://www.gnu.org/licenses/>.
 import csv
 import logging
+import numpy
 import os
 import re
 import subprocess
@@ -264,3 +265,33 @@ def sqlite_default(default='sqlite:///'):
             url = default + url
         return url
     return parse_url
+
+
+def pack_strings(values):
+    '''
+    Encode a sequence of strings or None as a single utf-8 byte array of
+    null-separated values and a mask of missing values. Unicode strings
+    are encoded as utf-8 and byte strings are assumed to be utf-8.
+    '''
+    missing = numpy.array([not isinstance(v, basestring) for v in values],
+                          dtype=bool)
+    data = b'\0'.join(
+        b'' if m else v.encode('utf-8') if isinstance(v, unicode) else v
+        for v, m in zip(values, missing))
+    assert data.count(b'\0') == max(len(values) - 1, 0)
+    return numpy.frombuffer(data, dtype=numpy.uint8), missing
+
+
+def unpack_strings(data, missing, decode=True):
+    '''
+    Decode strings encoded by pack_strings as an object array of unicode
+    strings, or of utf-8 byte strings if not ``decode``
+    '''
+    if not len(missing):
+        return numpy.array([], dtype=object)
+    data = data.tostring()
+    if decode:
+        data = data.decode('utf-8')
+    values = numpy.array(data.split('\0'), dtype=object)
+    values[missing] = None
+    return values
@@ -52,6 +52,8 @@ class TestLoadData(TestBase):
         with engine.begin() as conn:
             result = conn.execute('select 1 AS i from names')
             self.assertEqual(self.names_rows_count, len(list(result)))
+        indexes = sqlalchemy.inspect(engine).get_indexes('names')
+        self.assertIn('ix_names_tax_name', [i['name'] for i in indexes])
 
         # test clobber argument
         taxtastic.ncbi.db_connect(engine, clobber=True)
@@ -1,3 +1,5 @@
+import csv
+import itertools
 import unittest
 import tempfile
 import shutil
@@ -5,6 +7,7 @@ import json
 import copy
 import os
 import os.path
+import sqlite3
 
 from taxtastic import refpkg, utils
 from . import config
@@ -270,6 +273,93 @@ class TestRefpkg(unittest.TestCase):
             assert not os.path.exists(rpkg)
             self.assertRaises(ValueError, refpkg.Refpkg, rpkg, create=False)
 
+    def test_load_db_cache(self):
+        with config.tempdir() as d:
+            rpkg = os.path.join(d, 'test.refpkg')
+            shutil.copytree(config.data_path(
+                'lactobacillus2-0.2.refpkg'), rpkg)
+            cache_dir = os.path.join(d, 'cache')
+            r = refpkg.Refpkg(rpkg, create=False)
+
+            def taxa(r):
+                return r.db.execute(
+                    'SELECT tax_id, tax_name, rank FROM taxa '
+                    'ORDER BY tax_id').fetchall()
+
+            r.load_db()
+            expected = taxa(r)
+            r.load_db(cache_dir=cache_dir)
+            self.assertEqual(expected, taxa(r))
+            cached, = os.listdir(cache_dir)
+            mtime = os.path.getmtime(os.path.join(cache_dir, cached))
+
+            # reopened without building it again
+            r = refpkg.Refpkg(rpkg, create=False)
+            r.load_db(cache_dir=cache_dir)
+            self.assertEqual(expected, taxa(r))
+            self.assertEqual([cached], os.listdir(cache_dir))
+            self.assertEqual(
+                mtime, os.path.getmtime(os.path.join(cache_dir, cached)))
+            self.assertEqual('1578', sql_mrca(r.db, ('1579', '1633')))
+            self.assertEqual([('table',)], r.db.execute(
+                "SELECT type FROM sqlite_master WHERE name = 'parents'"
+            ).fetchall())
+            self.assertRaises(sqlite3.OperationalError, r.db.execute,
+                              "DELETE FROM taxa")
+
+            # a new seq_info is cached separately
+            r.update_file('seq_info', config.data_path('simple_seqinfo.csv'))
+            r.load_db(cache_dir=cache_dir)
+            self.assertEqual(2, len(os.listdir(cache_dir)))
+
+
+def sql_mrca(db, tax_ids):
+    """
+    Find the MRCA of tax_ids by querying a database loaded by
+    Refpkg.load_db
+    """
+    (parent,), = db.execute("""
+        SELECT parent
+        FROM   parents
+               JOIN taxa
+                 ON parent = taxa.tax_id
+               JOIN ranks USING (rank)
+        WHERE  child IN (%s)
+        GROUP  BY parent
+        HAVING COUNT(*) = ?
+        ORDER  BY rank_order DESC
+        LIMIT  1
+    """ % ', '.join('?' * len(tax_ids)), tax_ids + (len(tax_ids),))
+    return parent
+
+
+class TestMostRecentCommonAncestor(unittest.TestCase):
+
+    def setUp(self):
+        self.rp = refpkg.Refpkg(
+            config.data_path('lactobacillus2-0.2.refpkg'), create=False)
+        self.rp.load_db()
+
+    def test_mrca(self):
+        mrca = self.rp.most_recent_common_ancestor
+        self.assertEqual('1578', mrca('1579', '1633'))
+        self.assertEqual('1578_1', mrca('1587', '47770'))
+        self.assertEqual('91061', mrca('1579', '91061'))
+        self.assertEqual('1579', mrca('1579'))
+        self.assertEqual('2', mrca('562', '1582', '1633'))
+
+    def test_mrca_sql(self):
+        # the in-memory index agrees with the query on the database
+        with self.rp.open_resource('taxonomy') as f:
+            tax_ids = [row['tax_id'] for row in csv.DictReader(f)]
+        for a, b in itertools.combinations(tax_ids, 2):
+            self.assertEqual(sql_mrca(self.rp.db, (a, b)),
+                             self.rp.most_recent_common_ancestor(a, b))
+
+    def test_no_ancestor(self):
+        self.assertRaises(refpkg.NoAncestor,
+                          self.rp.most_recent_common_ancestor, '1579', 'foo')
+
 
 if __name__ == '__main__':
     unittest.main()
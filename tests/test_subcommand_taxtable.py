@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 
+from cStringIO import StringIO
 from os import path
 import logging
+import os
+import shutil
 
+import pandas
 from sqlalchemy import create_engine
 
 from . import config
 from .config import TestBase
 
 from taxtastic.taxonomy import Taxonomy
+from taxtastic.subcommands.taxtable import (
+    build_taxtable, subset_nodes, cached_taxtable, database_fingerprint,
+    read_cache, write_cache, select_clades, write_csv)
 
 log = logging
 
@@ -190,3 +197,173 @@ class TestWriteTable(TaxTableSetup):
         tax_id = '1378'  # Gemella; lineage has two successive no_rank taxa
         for tax_id in ['1378', '1280', '131110']:
             self.tax.lineage(tax_id)
+
+
+class TestBuildTaxtable(TaxTableSetup):
+
+    def setUp(self):
+        super(TestBuildTaxtable, self).setUp()
+        ranks = pandas.read_sql_table('ranks', self.engine)
+        ranks = ranks.sort_values(by='height', ascending=False)
+        self.ranks = ranks['rank'].tolist()
+        self.nodes = pandas.read_sql_table(
+            'nodes', self.engine, index_col='tax_id')
+
+    def test01(self):
+        taxtable = build_taxtable(self.nodes, self.ranks)
+        self.assertEqual(len(self.nodes), len(taxtable))
+        self.assertEqual(
+            [r for r in self.ranks if r in taxtable.columns],
+            taxtable.columns[-len(set(self.nodes['rank'])):].tolist())
+        for tax_id, row in taxtable.iterrows():
+            lineage = dict(row[self.ranks].dropna())
+            self.assertEqual(dict(self.tax._get_lineage(tax_id)), lineage)
+
+    def test02(self):
+        """
+        nodes not connected to the root are dropped
+        """
+        nodes = self.nodes.copy()
+        nodes.loc['1239', 'parent_id'] = 'buh'  # Firmicutes
+        taxtable = build_taxtable(nodes, self.ranks)
+        self.assertNotIn('1239', taxtable.index)
+        self.assertNotIn('1280', taxtable.index)
+        self.assertIn('2', taxtable.index)
+
+    def test03(self):
+        """
+        subset_nodes includes all ancestors and their primary names
+        """
+        tax_ids = ['1280', '1378', '131110']
+        nodes = subset_nodes(self.tax, tax_ids, chunksize=2)
+        expected = set()
+        for tax_id in tax_ids:
+            expected.update(t for _, t in self.tax._get_lineage(tax_id))
+        self.assertEqual(expected, set(nodes.index))
+        self.assertEqual(
+            'Staphylococcus aureus', nodes.loc['1280', 'tax_name'])
+
+        subset = build_taxtable(nodes, self.ranks)
+        full = build_taxtable(self.nodes, self.ranks).loc[subset.index]
+        full = full.dropna(axis=1, how='all')
+        self.assertTrue(
+            subset[full.columns].fillna('').equals(full.fillna('')))
+
+    def test04(self):
+        taxtable = build_taxtable(self.nodes, self.ranks)
+        clades = select_clades(taxtable, ['1279', '1378'])  # genera
+        expected = set(taxtable.index[
+            taxtable['genus'].isin(['1279', '1378'])])
+        for tax_id in ['1279', '1378']:
+            expected.update(t for _, t in self.tax._get_lineage(tax_id))
+        self.assertEqual(expected, set(clades.index))
+        self.assertEqual(list(taxtable.columns), list(clades.columns))
+
+    def test05(self):
+        taxtable = build_taxtable(self.nodes, self.ranks)
+        self.assertRaises(ValueError, select_clades, taxtable, ['1', 'buh'])
+
+    def test06(self):
+        """
+        writing in chunks gives the same csv as writing all at once
+        """
+        taxtable = build_taxtable(self.nodes, self.ranks)
+        columns = ['rank', 'parent_id', 'root', 'phylum', 'species']
+        rows = range(len(taxtable))[::-1]
+        expected = StringIO()
+        taxtable.iloc[rows][columns].to_csv(expected)
+        for chunksize in [7, len(taxtable), 10000]:
+            out = StringIO()
+            write_csv(taxtable, columns, rows, out, chunksize=chunksize)
+            self.assertEqual(expected.getvalue(), out.getvalue())
+
+    def test07(self):
+        taxtable = build_taxtable(self.nodes, self.ranks)
+        self.assertFalse(taxtable['is_valid'].all())
+
+        # remove invalid nodes one rank at a time
+        expected = taxtable.copy()
+        invalid = expected[~expected['is_valid']]
+        for r, g in invalid.groupby(by='rank'):
+            expected.loc[expected[r].isin(g.index), r] = None
+        expected = expected[expected['is_valid']]
+
+        valid = build_taxtable(self.nodes, self.ranks, valid=True)
+        self.assertTrue(valid['is_valid'].all())
+        self.assertTrue(expected.fillna('').equals(
+            valid.reindex(columns=expected.columns).fillna('')))
+
+
+class TestCachedTaxtable(TaxTableSetup):
+
+    def setUp(self):
+        self.outdir = self.mkoutdir()
+        self.dbname = path.join(self.outdir, 'taxonomy.db')
+        shutil.copyfile(dbname, self.dbname)
+        self.engine = create_engine('sqlite:///' + self.dbname, echo=echo)
+        self.tax = Taxonomy(self.engine)
+        ranks = pandas.read_sql_table('ranks', self.engine)
+        ranks = ranks.sort_values(by='height', ascending=False)
+        self.ranks = ranks['rank'].tolist()
+        nodes = pandas.read_sql_table(
+            'nodes', self.engine, index_col='tax_id')
+        nodes['tax_name'] = None
+        nodes.loc['1280', 'tax_name'] = u'Staphylococcus aureus \xe9'
+        self.nodes = nodes
+        self.taxtable = build_taxtable(nodes, self.ranks)
+
+    def test01(self):
+        fname = path.join(self.outdir, 'taxtable.npz')
+        write_cache(self.taxtable, self.ranks, fname)
+        columns = ['parent_id', 'rank', 'is_valid', 'tax_name'] + \
+            [r for r in self.ranks if r in self.taxtable.columns]
+        self.assertTrue(read_cache(fname).equals(self.taxtable[columns]))
+
+        valid = read_cache(fname, valid=True)
+        expected = build_taxtable(self.nodes, self.ranks, valid=True)
+        self.assertLess(len(valid), len(self.taxtable))
+        self.assertTrue(valid.fillna('').equals(
+            expected.reindex(columns=valid.columns).fillna('')))
+
+    def test02(self):
+        cache_dir = path.join(self.outdir, 'cache')
+        first = cached_taxtable(self.tax, self.ranks, cache_dir)
+        cached = os.listdir(cache_dir)
+        self.assertEqual(1, len(cached))
+        second = cached_taxtable(self.tax, self.ranks, cache_dir)
+        self.assertEqual(cached, os.listdir(cache_dir))
+        self.assertTrue(second.fillna('').equals(
+            first[second.columns].fillna('')))
+
+    def test03(self):
+        """
+        the fingerprint changes with the taxonomy
+        """
+        before = database_fingerprint(self.tax, self.ranks)
+        self.assertEqual(before, database_fingerprint(self.tax, self.ranks))
+        self.tax.nodes.update(
+            self.tax.nodes.c.tax_id == '1280').execute(is_valid=False)
+        self.assertNotEqual(
+            before, database_fingerprint(self.tax, self.ranks))
+
+    def test04(self):
+        """
+        the fingerprint changes with writes to the write-ahead log
+        """
+        with self.engine.connect() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            before = database_fingerprint(self.tax, self.ranks)
+            mtime = path.getmtime(self.dbname)
+            conn.execute(
+                "UPDATE nodes SET parent_id = '1' WHERE tax_id = '1280'")
+            # not yet written to the database file
+            self.assertEqual(mtime, path.getmtime(self.dbname))
+            self.assertNotEqual(
+                before, database_fingerprint(self.tax, self.ranks))
+
+    def test05(self):
+        """
+        only sqlite database files can be fingerprinted
+        """
+        tax = Taxonomy(create_engine('sqlite://'))
+        self.assertRaises(ValueError, database_fingerprint, tax, self.ranks)
@@ -6,11 +6,13 @@ import copy
 import os
 import os.path
 import argparse
+import csv
 
 from taxtastic import refpkg
 from taxtastic.subcommands import (
     update, create, strip, rollback, rollforward,
-    taxtable, check, add_to_taxtable, merge_taxtables)
+    taxtable, check, add_to_taxtable, merge_taxtables, refpkg_intersection)
+from taxtastic.taxtable import TaxNode
 
 import config
 from config import OutputRedirectMixin, data_path, TestBase
@@ -277,6 +279,10 @@ class TestTaxtable(OutputRedirectMixin, unittest.TestCase):
                     verbosity = 0
                     out = h
                     clade_ids = None
+                    taxtable = None
+                    cache_dir = None
+                    parquet = None
+                    arrow = None
                 self.assertRaises(ValueError, taxtable.action, _Args())
 
     def test_seqinfo(self):
@@ -294,6 +300,9 @@ class TestTaxtable(OutputRedirectMixin, unittest.TestCase):
                 verbosity = 0
                 clade_ids = None
                 taxtable = None
+                cache_dir = None
+                parquet = None
+                arrow = None
             self.assertIsNone(taxtable.action(_Args()))
             # No output check at present
             self.assertTrue(tf.tell() > 0)
@@ -344,3 +353,45 @@ class TestMergeTaxtables(TestBase):
     def test03(self):
         args = self.parser.parse_args([self.t2, self.t1, '-o', self.outfile])
         self.assertRaises(SystemExit, merge_taxtables.action, args)
+
+
+class TestRefpkgIntersection(TestBase):
+
+    def setUp(self):
+        self.refpkg = data_path('lactobacillus2-0.2.refpkg')
+        self.taxtable = os.path.join(self.refpkg, 'taxtable.csv')
+        self.parser = argparse.ArgumentParser()
+        refpkg_intersection.build_parser(self.parser)
+        self.outfile = os.path.join(self.mkoutdir(), 'intersection.csv')
+        with open(self.taxtable) as fp:
+            self.tree = TaxNode.from_taxtable(fp)
+
+    def intersection(self, *arguments):
+        common = [self.taxtable, '-c', self.refpkg, '-o', self.outfile]
+        args = self.parser.parse_args(common + list(arguments))
+        refpkg_intersection.action(args)
+        args.out.close()
+        with open(self.outfile) as fp:
+            return [tuple(row) for row in csv.reader(fp)]
+
+    def test_lowest_rank(self):
+        rows = self.intersection('-r', 'genus,species')
+        self.assertEqual(('tax_id', 'intersection_rank'), rows[0])
+        self.assertEqual(sorted(self.tree.index), [r[0] for r in rows[1:]])
+        for tax_id, rank in rows[1:]:
+            ranks = [n.rank for n in self.tree.get_node(tax_id).lineage()
+                     if n.rank in ('genus', 'species')]
+            self.assertEqual(ranks[-1] if ranks else '', rank)
+
+    def test_all_ranks(self):
+        rows = self.intersection('-r', 'family,genus', '--all-ranks')
+        expected = []
+        for tax_id in sorted(self.tree.index):
+            ranks = [n.rank for n in self.tree.get_node(tax_id).lineage()
+                     if n.rank in ('family', 'genus')]
+            expected.extend((tax_id, r) for r in reversed(ranks or ['']))
+        self.assertEqual(expected, rows[1:])
+
+    def test_cycle(self):
+        self.assertRaises(ValueError, refpkg_intersection.lineage_ranks,
+                          [0, 2, 1], [0, 1, 2])
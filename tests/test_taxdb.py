@@ -0,0 +1,107 @@
+import csv
+import itertools
+import random
+import unittest
+
+from taxtastic.taxdb import MrcaIndex, Taxdb, closure, nested_set
+from taxtastic.taxtable import TaxNode
+from .config import data_path
+
+
+class NestedSetTestCase(unittest.TestCase):
+
+    def test_forest(self):
+        # 0 -> (1 -> 3, 2); 4 -> 5
+        lft, rgt = nested_set([0, 0, 0, 1, 4, 4])
+        intervals = zip(lft, rgt)
+        self.assertEqual(list(range(1, 13)), sorted(lft + rgt))
+        self.assertEqual((1, 8), intervals[0])
+        self.assertEqual((9, 12), intervals[4])
+
+        def contains(a, b):
+            return intervals[a][0] < intervals[b][0] < intervals[a][1]
+
+        self.assertTrue(contains(0, 3))
+        self.assertTrue(contains(1, 3))
+        self.assertFalse(contains(2, 3))
+        self.assertFalse(contains(0, 5))
+
+    def test_closure(self):
+        lft, rgt = nested_set([0, 0, 0, 1, 4, 4])
+        self.assertEqual(
+            set([(0, 0), (1, 1), (1, 0), (2, 2), (2, 0), (3, 3), (3, 1),
+                 (3, 0), (4, 4), (5, 5), (5, 4)]),
+            set(closure(lft, rgt)))
+
+
+class TaxdbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Taxdb()
+        self.db.create_tables()
+        with open(data_path('simple_taxtable.csv')) as fp:
+            reader = csv.DictReader(fp)
+            self.db.insert_from_taxtable(lambda: reader._fieldnames, reader)
+        with open(data_path('simple_taxtable.csv')) as fp:
+            self.tree = TaxNode.from_taxtable(fp)
+
+    def assertParents(self):
+        cursor = self.db.cursor()
+        for node in self.tree:
+            cursor.execute('SELECT parent FROM parents WHERE child = ?',
+                           [node.tax_id])
+            self.assertEqual(set(i.tax_id for i in node.lineage()),
+                             set(parent for parent, in cursor))
+
+    def test_parents(self):
+        self.assertParents()
+
+    def test_create_closure(self):
+        self.db.create_closure()
+        self.assertParents()
+        (table,), = self.db.execute(
+            "SELECT type FROM sqlite_master WHERE name = 'parents'")
+        self.assertEqual('table', table)
+
+    def test_ranks(self):
+        ranks = self.db.execute(
+            'SELECT rank FROM ranks ORDER BY rank_order').fetchall()
+        self.assertEqual(self.tree.ranks, [rank for rank, in ranks])
+
+
+class MrcaIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        with open(data_path('simple_taxtable.csv')) as fp:
+            self.index = MrcaIndex.from_taxtable(fp)
+        with open(data_path('simple_taxtable.csv')) as fp:
+            self.tree = TaxNode.from_taxtable(fp)
+
+    def lineage_mrca(self, tax_ids):
+        lineages = [self.tree.get_node(t).lineage() for t in tax_ids]
+        common = [nodes[0] for nodes in zip(*lineages)
+                  if all(n is nodes[0] for n in nodes)]
+        return common[-1].tax_id
+
+    def test_pairs(self):
+        tax_ids = list(self.tree.index)
+        for a, b in itertools.combinations(tax_ids, 2):
+            self.assertEqual(self.lineage_mrca([a, b]),
+                             self.index.mrca([a, b]))
+
+    def test_sets(self):
+        tax_ids = list(self.tree.index)
+        random.seed(1)
+        for size in [1, 3, 10, 50]:
+            ts = random.sample(tax_ids, size)
+            self.assertEqual(self.lineage_mrca(ts), self.index.mrca(ts))
+
+    def test_missing(self):
+        self.assertIsNone(self.index.mrca([]))
+        self.assertIsNone(self.index.mrca(['1303', 'foo']))
+
+    def test_forest(self):
+        index = MrcaIndex(['a', 'b', 'c', 'd', 'e'], [0, 0, 0, 3, 3])
+        self.assertEqual('a', index.mrca(['b', 'c']))
+        self.assertEqual('d', index.mrca(['e', 'd']))
+        self.assertIsNone(index.mrca(['b', 'e']))
@@ -3,15 +3,20 @@
 import os
 from os import path
 import logging
+import random
 import shutil
+import threading
+from multiprocessing.pool import ThreadPool
 
-from sqlalchemy import create_engine
+import sqlalchemy
+from sqlalchemy import create_engine, MetaData
 
 import config
 from config import TestBase
 
 import taxtastic
-from taxtastic.taxonomy import Taxonomy
+from taxtastic.taxonomy import Taxonomy, AsyncTaxonomy
+from taxtastic.subcommands.new_database import load_taxonomy_table
 import taxtastic.ncbi
 import taxtastic.utils
 
@@ -109,6 +114,170 @@ class TestAddNode(TestTaxonomyBase):
             self.assertTrue(lineage['parent_id'] == new_taxid)
 
 
+class TestTaxonomyTable(TestTaxonomyBase):
+    """
+    test lineages stored in the materialized taxonomy table
+    """
+
+    def setUp(self):
+        self.dbname = path.join(self.mkoutdir(), 'taxonomy.db')
+        shutil.copyfile(dbname, self.dbname)
+        engine = create_engine('sqlite:///' + self.dbname, echo=echo)
+        load_taxonomy_table(engine, MetaData())
+        engine.dispose()
+        super(TestTaxonomyTable, self).setUp()
+
+    def test01(self):
+        self.assertIsNotNone(self.tax.taxonomy)
+        self.assertEqual('root', self.tax.taxonomy_ranks[0])
+
+        walked = Taxonomy(create_engine('sqlite:///' + dbname, echo=echo))
+        for tax_id in ['1', '1280', '1378', '131110']:
+            self.assertEqual(walked._get_lineage(tax_id),
+                             self.tax._get_lineage(tax_id))
+
+    def test02(self):
+        new_taxid = '1578_1'
+        children = ['47770',  # crispatus
+                    '1587']  # helveticus
+
+        self.tax.add_node(
+            tax_id=new_taxid,
+            parent_id='1578',
+            rank='species_group',
+            tax_name='Lactobacillus helveticis/crispatus',
+            children=children,
+            source_id=2
+        )
+
+        lineage = self.tax._taxonomy_lineage(new_taxid)
+        self.assertEqual(('species_group', new_taxid), lineage[-1])
+        self.assertEqual(('genus', '1578'), lineage[-2])
+
+        for taxid in children:
+            lineage = dict(self.tax._taxonomy_lineage(taxid))
+            self.assertEqual(new_taxid, lineage['species_group'])
+
+    def test03(self):
+        # move Staphylococcus (1279) from Staphylococcaceae to Bacillaceae
+        self.tax.update_node('1279', parent_id='186817', source_id=2)
+        for tax_id in ['1279', '1280']:  # Staphylococcus, S. aureus
+            lineage = dict(self.tax._taxonomy_lineage(tax_id))
+            self.assertEqual('186817', lineage['family'])
+            self.assertEqual('1279', lineage['genus'])
+
+
+class TestBulkSynonyms(TestTaxonomyBase):
+
+    def setUp(self):
+        self.dbname = path.join(self.mkoutdir(), 'taxonomy.db')
+        shutil.copyfile(dbname, self.dbname)
+        super(TestBulkSynonyms, self).setUp()
+
+    def test01(self):
+        indexes = sqlalchemy.inspect(self.engine).get_indexes('names')
+        tax_ids = ['1378', '1280', '91061']
+        synonyms = self.tax.bulk_synonyms(
+            tax_ids=tax_ids[:2], tax_names=['Bacilli', 'Gemella'],
+            chunksize=1)
+        self.assertEqual(set(tax_ids), set(synonyms))
+        for tax_id in tax_ids:
+            expected = sorted(tuple(r) for r in self.tax.synonyms(tax_id))
+            self.assertEqual(expected, synonyms[tax_id])
+
+        # the schema is left as it was
+        self.assertEqual(
+            indexes, sqlalchemy.inspect(self.engine).get_indexes('names'))
+
+    def test02(self):
+        self.assertEqual({}, self.tax.bulk_synonyms(tax_names=['buh']))
+
+
+class TestAsyncTaxonomy(TestBase):
+
+    tax_ids = ['1', '1280', '1378', '131110', '91061']
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///' + dbname, echo=echo)
+        self.tax = Taxonomy(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test01(self):
+        with AsyncTaxonomy(self.engine, processes=3) as atax:
+            results = [atax.lineage(t) for t in self.tax_ids * 10]
+            batch = atax.lineages(self.tax_ids)
+            name = atax.primary_from_name('Gemella Berger 1960')
+            synonyms = atax.synonyms(tax_id='1378')
+            missing = atax.lineage('buh')
+
+            expected = [self.tax.lineage(t) for t in self.tax_ids]
+            self.assertEqual(expected * 10, [r.get() for r in results])
+            self.assertEqual(expected, batch.get())
+            self.assertEqual(self.tax.primary_from_name('Gemella Berger 1960'),
+                             name.get())
+            self.assertEqual(self.tax.synonyms(tax_id='1378'),
+                             synonyms.get())
+            self.assertRaises(ValueError, missing.get)
+
+    def test02(self):
+        """
+        identical requests made while one is pending share a query,
+        and each gets its own copy of the result
+        """
+        with AsyncTaxonomy(self.engine, processes=1) as atax:
+            # occupy the only worker
+            event = threading.Event()
+            blocked = atax._submit(lambda tax: event.wait())
+            first = atax.lineage('1280')
+            second = atax.lineage('1280')
+            other = atax.lineage('1378')
+            self.assertIs(first._result, second._result)
+            self.assertIsNot(first._result, other._result)
+            event.set()
+            blocked.get()
+            lineage = first.get()
+            lineage['rank'] = 'buh'
+            self.assertEqual(self.tax.lineage('1280'), second.get())
+
+
+class TestSharedTaxonomy(TestBase):
+    """
+    concurrent lookups on one Taxonomy give the same results as serial ones
+    """
+
+    # rename "below_root" nodes so that threads also race to add a rank
+    kwargs = {'NO_RANK': 'below_root', 'undef_prefix': 'under_'}
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///' + dbname, echo=echo)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test01(self):
+        serial = Taxonomy(self.engine, **self.kwargs)
+        tax_ids = serial.tax_ids()
+        expected = dict((t, serial.lineage(t)) for t in tax_ids)
+
+        tax = Taxonomy(self.engine, **self.kwargs)
+        requests = tax_ids * 4
+        random.Random(1).shuffle(requests)
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda t: (t, tax.lineage(t)), requests)
+        finally:
+            pool.close()
+            pool.join()
+
+        for tax_id, lineage in results:
+            self.assertEqual(expected[tax_id], lineage)
+        self.assertEqual(serial.ranks, tax.ranks)
+        self.assertEqual(1, tax.ranks.count('under_root'))
+        self.assertEqual(set(tax.ranks), tax.rankset)
+
+
 def test__node():
     engine = create_engine(
         'sqlite:///../testfiles/small_taxonomy.db', echo=False)
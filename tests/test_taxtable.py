@@ -1,9 +1,19 @@
 from cStringIO import StringIO
 import os.path
+import pickle
+import sqlite3
 import unittest
 
-from taxtastic.taxtable import TaxNode
-from .config import data_path
+import pandas
+
+from taxtastic.taxtable import TaxNode, read_table, write_table
+from .config import data_path, ncbi_master_db, TestBase
+
+try:
+    import pyarrow  # noqa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 DN = os.path.dirname(__file__)
 
@@ -27,6 +37,38 @@ class TaxNodeTestCase(unittest.TestCase):
         self.assertEqual(['1', '131567', '2', '1239', '91061', '186826', '1300', '1301', '1303'],
                          [i.tax_id for i in lineage])
 
+    def test_iter_order(self):
+        def preorder(node):
+            yield node
+            for child in node.children:
+                for i in preorder(child):
+                    yield i
+
+        def postorder(node):
+            for child in node.children:
+                for i in postorder(child):
+                    yield i
+            yield node
+
+        self.assertEqual(list(preorder(self.root)),
+                         list(self.root.depth_first_iter()))
+        self.assertEqual(list(postorder(self.root)),
+                         list(self.root.depth_first_iter(self_first=False)))
+
+    def test_deep(self):
+        # deeper than the recursion limit
+        root = TaxNode('root', '0')
+        node = root
+        for i in xrange(1, 5000):
+            child = TaxNode('no_rank', str(i))
+            node.add_child(child)
+            node = child
+        self.assertEqual(5000, len(node.lineage()))
+        self.assertEqual('4999', list(root)[-1].tax_id)
+        self.assertEqual(
+            '0', list(root.depth_first_iter(self_first=False))[-1].tax_id)
+        self.assertIs(node, root.path([str(i) for i in xrange(5000)]))
+
     def test_write_taxtable(self):
         expected = '''"tax_id","parent_id","rank","tax_name","root","below_root","superkingdom","phylum","class","order","family","genus","species"
 "1","1","root","root","1","","","","","","","",""
@@ -62,6 +104,107 @@ class TaxNodeTestCase(unittest.TestCase):
         self.assertEqual(self.root.get_node('1303').sequence_ids, set())
         self.assertEqual(self.root.get_node('1301').sequence_ids, set())
 
+    def assertIndexed(self, root):
+        self.assertEqual(set(root.index), set(i.tax_id for i in root))
+        for node in root:
+            self.assertIs(root.index, node.index)
+
+    def test_collapse_remove(self):
+        node = self.root.get_node('1300')
+        self.root.get_node('1303').sequence_ids.add('seq1')
+        self.root.get_node('1301').sequence_ids.add('seq2')
+        node.collapse(remove=True)
+        self.assertEqual(set(['seq1', 'seq2']), node.sequence_ids)
+        self.assertTrue(node.is_leaf)
+        self.assertNotIn('1301', self.root.index)
+        self.assertNotIn('1303', self.root.index)
+        self.assertIndexed(self.root)
+
+    def test_prune_nodes(self):
+        self.root.prune_nodes('species')
+        self.assertEqual(set(), set(i.rank for i in self.root) & {'species'})
+        self.assertIn('1301', self.root.index)
+        self.assertNotIn('1303', self.root.index)
+        self.assertIndexed(self.root)
+
+        self.root.prune_nodes(lambda node: node.tax_id == '1239')
+        self.assertNotIn('1239', self.root.index)
+        self.assertNotIn('1301', self.root.index)
+        self.assertIndexed(self.root)
+
+    def test_collapse_nodes(self):
+        self.root.get_node('1303').sequence_ids.add('seq1')
+        self.root.get_node('1301').sequence_ids.add('seq2')
+        self.root.collapse_nodes('genus', remove=True)
+        genus = self.root.get_node('1301')
+        self.assertEqual(set(['seq1', 'seq2']), genus.sequence_ids)
+        self.assertTrue(all(i.is_leaf for i in self.root if i.rank == 'genus'))
+        self.assertIndexed(self.root)
+
+    def test_drop_nodes(self):
+        self.root.get_node('1303').sequence_ids.add('seq1')
+        self.root.get_node('1301').sequence_ids.add('seq2')
+        self.root.drop_nodes(lambda node: node.rank in ('genus', 'family'))
+        order = self.root.get_node('186826')
+        self.assertEqual(set(['seq2']), order.sequence_ids)
+        self.assertIs(order, self.root.get_node('1303').parent)
+        ranks = set(i.rank for i in self.root)
+        self.assertEqual(set(), ranks & {'genus', 'family'})
+        self.assertIndexed(self.root)
+
+    def test_populate_from_seqinfo(self):
+        seqinfo = StringIO('seqname,accession,tax_id\n'
+                           's1,a1,1303\n'
+                           's2,a2,1301\n'
+                           's3,a3,\n'
+                           's4,a4,1303\n'
+                           's5,a5,unknown\n'
+                           'NA,a6,1301\n')
+        self.root.populate_from_seqinfo(seqinfo, chunksize=4)
+        self.assertEqual(set(['s1', 's4']),
+                         self.root.get_node('1303').sequence_ids)
+        self.assertEqual(set(['s2', 'NA']),
+                         self.root.get_node('1301').sequence_ids)
+        self.assertEqual(4, self.root.subtree_sequence_count())
+
+    def test_subtree_sequence_count(self):
+        def count(node):
+            return len(set(node.subtree_sequence_ids()))
+
+        self.root.get_node('1303').sequence_ids.update(['seq1', 'seq2'])
+        self.root.get_node('1301').sequence_ids.add('seq3')
+        self.root.get_node('1239').sequence_ids.add('seq4')
+        self.assertEqual(4, self.root.subtree_sequence_count())
+        for node in self.root:
+            self.assertEqual(count(node), node.subtree_sequence_count())
+
+        # reading nodes keeps cached counts and allocates no sets
+        for node in self.root:
+            node.children, node.sequence_ids
+        self.root.write_taxtable(StringIO())
+        self.assertTrue(all(node._count is not None for node in self.root))
+        self.assertIsNone(self.root.get_node('1303')._children)
+        self.assertIsNone(self.root.get_node('1300')._sequence_ids)
+
+        # edits forget cached counts
+        self.root.get_node('1303').sequence_ids.add('seq5')
+        self.assertEqual(5, self.root.subtree_sequence_count())
+        sequence_ids = self.root.get_node('1300').sequence_ids
+        sequence_ids |= set(['seq6'])
+        self.assertEqual(set(['seq6']), self.root.get_node('1300').sequence_ids)
+        self.assertEqual(6, self.root.subtree_sequence_count())
+        sequence_ids.clear()
+        self.assertEqual(5, self.root.subtree_sequence_count())
+        self.assertEqual(4, self.root.get_node('1301').subtree_sequence_count())
+        self.root.get_node('1301').drop()
+        self.assertEqual(4, self.root.get_node('1300').subtree_sequence_count())
+        self.root.get_node('1300').collapse(remove=True)
+        self.root.get_node('1300').remove_subtree()
+        self.assertEqual(1, self.root.subtree_sequence_count())
+        self.root.get_node('1239').sequence_ids = set()
+        for node in self.root:
+            self.assertEqual(0, node.subtree_sequence_count())
+
     def test_drop(self):
         tax_id = "1301"
         sequence_ids = ['dsequence1', 'dsequence2']
@@ -86,3 +229,162 @@ class TaxNodeTestCase(unittest.TestCase):
 
     def test_drop_root(self):
         self.assertRaises(ValueError, self.root.drop)
+
+    def test_compact(self):
+        node = self.root.get_node('1303')
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIsNone(node._children)
+        self.assertIsNone(node._sequence_ids)
+        self.assertEqual(0, sum(1 for i in node.subtree_sequence_ids()))
+        self.assertIs(node.rank, self.root.get_node('1304').rank)
+        node.sequence_ids.add('seq1')
+        self.assertEqual(set(['seq1']), node._sequence_ids)
+
+    def test_pickle(self):
+        self.root.get_node('1303').sequence_ids.update(['seq1', 'seq2'])
+        self.root.get_node('1300').sequence_ids.add('seq3')
+        self.assertEqual(3, self.root.subtree_sequence_count())
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            root = pickle.loads(pickle.dumps(self.root, protocol))
+            self.assertEqual(
+                sorted((n.tax_id, n.rank, n.name) for n in self.root),
+                sorted((n.tax_id, n.rank, n.name) for n in root))
+            self.assertIndexed(root)
+            node = root.get_node('1303')
+            self.assertIs(root.get_node('1301'), node.parent)
+            self.assertEqual(set(['seq1', 'seq2']), node.sequence_ids)
+            self.assertIs(node.rank, self.root.get_node('1303').rank)
+            self.assertEqual(3, root.subtree_sequence_count())
+            node.sequence_ids.add('seq4')
+            self.assertEqual(4, root.subtree_sequence_count())
+
+    def test_missing_parent(self):
+        with open(data_path('simple_taxtable.csv')) as fp:
+            lines = fp.readlines()
+        # drop the row for 1301, which is the parent of 1303
+        lines = [l for l in lines if not l.startswith('"1301",')]
+        self.assertRaises(ValueError, TaxNode.from_taxtable,
+                          StringIO(''.join(lines)))
+
+    def test_binary(self):
+        self.root.get_node('1303').sequence_ids.update(['seq1', 'seq2'])
+        self.root.get_node('1300').sequence_ids.add('seq3')
+        s = StringIO()
+        self.root.write_binary(s)
+        s.seek(0)
+        root = TaxNode.from_binary(s)
+
+        self.assertEqual(self.root.ranks, root.ranks)
+        self.assertEqual(set(self.root.index), set(root.index))
+        for node in self.root:
+            other = root.get_node(node.tax_id)
+            self.assertEqual(node.rank, other.rank)
+            self.assertEqual(node.name, other.name)
+            self.assertIs(type(node.name), type(other.name))
+            self.assertEqual(node.sequence_ids, other.sequence_ids)
+            self.assertEqual(set(i.tax_id for i in node.children),
+                             set(i.tax_id for i in other.children))
+            if node.parent is not None:
+                self.assertEqual(node.parent.tax_id, other.parent.tax_id)
+
+    def test_binary_non_ascii(self):
+        taxtable = StringIO(
+            '"tax_id","parent_id","rank","tax_name","root","species"\n'
+            '"1","1","root","root","1",""\n'
+            '"2","1","species","Caf\xc3\xa9 bacterium","1","2"\n')
+        root = TaxNode.from_taxtable(taxtable)
+        s = StringIO()
+        root.write_binary(s)
+        s.seek(0)
+        other = TaxNode.from_binary(s)
+        self.assertEqual('Caf\xc3\xa9 bacterium', other.get_node('2').name)
+        self.assertEqual(root.get_node('2').name, other.get_node('2').name)
+
+
+class FromTaxdbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.con = sqlite3.connect(ncbi_master_db)
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_from_taxdb(self):
+        root = TaxNode.from_taxdb(self.con)
+        nodes = self.con.execute(
+            'SELECT tax_id, parent_id FROM nodes').fetchall()
+        self.assertEqual(set(tax_id for tax_id, _ in nodes), set(root.index))
+        for tax_id, parent_id in nodes:
+            node = root.get_node(tax_id)
+            if node is not root:
+                self.assertEqual(parent_id, node.parent.tax_id)
+        self.assertEqual('Firmicutes', root.get_node('1239').name)
+
+    def test_from_taxdb_root(self):
+        root = TaxNode.from_taxdb(self.con, '1239')
+        self.assertEqual('1239', root.tax_id)
+        self.assertEqual(set(i.tax_id for i in root),
+                         set(root.index))
+        self.assertIn('1280', root.index)
+        self.assertNotIn('2', root.index)
+        self.assertEqual('Firmicutes', root.name)
+
+    def test_from_taxdb_missing_root(self):
+        self.assertRaises(ValueError, TaxNode.from_taxdb, self.con, 'foo')
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow is not installed.")
+class ColumnarTaxtableTestCase(TestBase):
+
+    def setUp(self):
+        self.csv = data_path('simple_taxtable.csv')
+        self.taxtable = pandas.read_csv(self.csv, dtype=str)
+        self.ranks = self.taxtable.columns[4:].tolist()
+        self.outdir = self.mkoutdir()
+
+    def write(self, taxtable, fmt):
+        fname = os.path.join(self.outdir, 'taxtable.' + fmt)
+        write_table(taxtable.set_index('tax_id'), fname, fmt, self.ranks)
+        return fname
+
+    def test_read_table(self):
+        for fmt in ['parquet', 'arrow']:
+            fname = self.write(self.taxtable, fmt)
+            self.assertTrue(self.taxtable.equals(read_table(fname)))
+            with open(fname) as fp:
+                self.assertTrue(self.taxtable.equals(read_table(fp)))
+        self.assertTrue(self.taxtable.equals(read_table(self.csv)))
+
+    def test_string_tax_ids(self):
+        taxtable = self.taxtable.replace('1303', 'x1303')
+        fname = self.write(taxtable, 'parquet')
+        self.assertTrue(taxtable.equals(read_table(fname)))
+
+    def test_non_ascii(self):
+        taxtable = self.taxtable.copy()
+        taxtable.loc[taxtable['tax_id'] == '1303', 'tax_name'] = \
+            'Streptococcus or\xc3\xa1lis'
+        for fmt in ['parquet', 'arrow']:
+            table = read_table(self.write(taxtable, fmt))
+            self.assertTrue(taxtable.equals(table))
+            self.assertTrue(all(type(i) is str for i in table['tax_name']))
+            self.assertTrue(all(type(i) is str for i in table['rank']))
+            with open(self.write(taxtable, fmt)) as fp:
+                root = TaxNode.from_taxtable(fp)
+            self.assertEqual('Streptococcus or\xc3\xa1lis',
+                             root.get_node('1303').name)
+            s = StringIO()
+            root.get_node('1303').write_taxtable(s)
+            self.assertIn('Streptococcus or\xc3\xa1lis', s.getvalue())
+
+    def test_from_taxtable(self):
+        with open(self.csv) as fp:
+            expected = TaxNode.from_taxtable(fp)
+        with open(self.write(self.taxtable, 'arrow')) as fp:
+            root = TaxNode.from_taxtable(fp)
+        self.assertEqual(set(expected.index), set(root.index))
+        for tax_id, node in expected.index.items():
+            other = root.get_node(tax_id)
+            self.assertEqual(
+                (node.rank, node.name, node.parent and node.parent.tax_id),
+                (other.rank, other.name, other.parent and other.parent.tax_id))